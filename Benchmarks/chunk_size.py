@@ -0,0 +1,79 @@
+"""Compare ways of streaming a download to disk against a local HTTP server:
+iter_content with different chunk sizes vs. readinto a reused buffer, in
+MB/s and CPU seconds per GB.
+
+ python3 Benchmarks/chunk_size.py [megabytes] [rounds]
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.argv = [sys.argv[0]]
+
+import requests  # noqa: E402
+
+import Modules.config as config  # noqa: E402
+from Modules.download import iter_chunks  # noqa: E402
+
+folder = tempfile.mkdtemp()
+with open(f"{folder}/file", "wb") as f:
+    for _ in range(megabytes):
+        f.write(os.urandom(1024 * 1024))
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+# a separate process, so that only the client's CPU time is measured
+server = subprocess.Popen(
+    [sys.executable, "-m", "http.server", "-b", "127.0.0.1", "-d", folder, str(port)],
+    stdout=subprocess.DEVNULL,
+    stderr=subprocess.DEVNULL,
+)
+url = f"http://127.0.0.1:{port}/file"
+session = requests.Session()
+target = f"{folder}/download"
+for _ in range(50):
+    try:
+        session.head(url)
+        break
+    except requests.ConnectionError:
+        time.sleep(0.1)
+
+
+def stream(size, readinto):
+    config.readinto = readinto
+    with session.get(url, stream=True) as r, open(target, "wb") as file:
+        for data in iter_chunks(r, size):
+            file.write(data)
+    assert os.path.getsize(target) == megabytes * 1024 * 1024
+
+
+cases = [
+    ("iter_content 1 KiB", 1024, False),
+    ("iter_content 64 KiB", 64 * 1024, False),
+    ("iter_content 1 MiB", 1024 * 1024, False),
+    ("readinto 64 KiB", 64 * 1024, True),
+    ("readinto 1 MiB", 1024 * 1024, True),
+]
+for name, size, readinto in cases:
+    wall = cpu = float("inf")
+    for _ in range(rounds):
+        started, started_cpu = time.perf_counter(), time.process_time()
+        stream(size, readinto)
+        wall = min(wall, time.perf_counter() - started)
+        cpu = min(cpu, time.process_time() - started_cpu)
+    print(
+        f"{name:22} {megabytes / wall:8.1f} MB/s {cpu * 1024 / megabytes:7.2f} CPU s/GB"
+    )
+server.terminate()
+server.wait()
+shutil.rmtree(folder)
@@ -0,0 +1,113 @@
+"""Run furaffinity-dl.py end to end against the local stand-in server
+(Benchmarks/standin.py) and report pages/s, submissions/s, MB/s and the peak
+RSS of the downloader.
+
+ python3 Benchmarks/end_to_end.py [--runs N] [--category CATEGORY] [stand-in options]
+                                   [-- furaffinity-dl options]
+
+e.g. compare the engines on a slow, flaky site:
+
+ python3 Benchmarks/end_to_end.py --latency 0.05 --error-rate 0.02 -- --engine threads
+ python3 Benchmarks/end_to_end.py --latency 0.05 --error-rate 0.02 -- --engine async
+"""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from Benchmarks.standin import arguments  # noqa: E402
+
+
+def take(argv, name, default):
+    """Remove an option of this script from argv, return its value"""
+    if name not in argv:
+        return default
+    index = argv.index(name)
+    value = argv[index + 1]
+    del argv[index : index + 2]
+    return value
+
+
+argv = sys.argv[1:]
+extra = []
+if "--" in argv:
+    argv, extra = argv[: argv.index("--")], argv[argv.index("--") + 1 :]
+runs = int(take(argv, "--runs", 1))
+category = take(argv, "--category", "gallery")
+options = arguments(argv)
+if "--port" not in argv:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        options.port = s.getsockname()[1]
+    argv += ["--port", str(options.port)]
+
+# in its own process, so that it doesn't count against the downloader
+server = subprocess.Popen(
+    [sys.executable, f"{root}/Benchmarks/standin.py", *argv], stdout=subprocess.DEVNULL
+)
+base_url = f"http://127.0.0.1:{options.port}"
+for _ in range(100):
+    try:
+        urllib.request.urlopen(f"{base_url}/gallery/{options.users.split(',')[0]}/999/")
+        break
+    except OSError:
+        time.sleep(0.1)
+
+
+def run():
+    output = tempfile.mkdtemp()
+    event_log = f"{output}/events.jsonl"
+    command = [
+        sys.executable,
+        f"{root}/furaffinity-dl.py",
+        "--base-url",
+        base_url,
+        "--output",
+        output,
+        "--event-log",
+        event_log,
+        "--progress",
+        "quiet",
+        *extra,
+        options.users.replace(",", " "),
+        category,
+    ]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=output, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+
+    pages = submissions = size = 0
+    with open(event_log, encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            if event["event"] == "page":
+                pages += 1
+            elif event["event"] == "download":
+                submissions += 1
+                size += event["bytes"]
+    shutil.rmtree(output)
+    # kilobytes on Linux, bytes on macOS
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    failed = f", exit status {status}" if status else ""
+    print(
+        f"{elapsed:6.1f}s {pages / elapsed:7.1f} pages/s {submissions / elapsed:7.1f} \
+submissions/s {size / 1024 / 1024 / elapsed:7.1f} MB/s {rss:6.1f} MB peak RSS \
+({pages} pages, {submissions} submissions{failed})"
+    )
+
+
+try:
+    for _ in range(runs):
+        run()
+finally:
+    server.terminate()
@@ -0,0 +1,55 @@
+"""Compare view id lookups against a large index.idx:
+the old regex scan of the whole file vs. the in-memory index.
+
+ python3 Benchmarks/index_lookup.py [entries] [lookups]
+"""
+
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def regex_scan(output_folder, path):
+    view_id = path.split("/")[-2:-1][0]
+    with open(f"{output_folder}/index.idx", encoding="utf-8") as idx:
+        return re.search(rf"\({view_id}\)", idx.read()) is not None
+
+
+with tempfile.TemporaryDirectory() as output_folder:
+    sys.argv = [sys.argv[0], "--output", output_folder]
+
+    from Modules import index
+
+    view_ids = random.sample(range(1, 60_000_000), entries)
+    with open(f"{output_folder}/index.idx", "w", encoding="utf-8") as idx:
+        idx.writelines(f"({view_id})\n" for view_id in view_ids)
+    probes = [f"/view/{random.randrange(1, 60_000_000)}/" for _ in range(lookups)]
+
+    start = time.perf_counter()
+    index.load_index()
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hits = sum(index.check_file(path) for path in probes)
+    set_time = time.perf_counter() - start
+
+    scan_probes = probes[: max(1, lookups // 1000)]
+    start = time.perf_counter()
+    scan_hits = sum(regex_scan(output_folder, path) for path in scan_probes)
+    scan_time = time.perf_counter() - start
+
+print(f"index entries:  {entries}")
+print(f"load index.idx: {load_time * 1000:.1f} ms (once per run)")
+print(f"in-memory:      {set_time / lookups * 1e6:.3f} us/lookup ({hits} hits)")
+print(
+    f"regex scan:     {scan_time / len(scan_probes) * 1e6:.1f} us/lookup "
+    f"({scan_hits} hits, {len(scan_probes)} lookups sampled)"
+)
@@ -0,0 +1,135 @@
+"""Run several furaffinity-dl.py processes as nodes sharing one output folder
+against the local stand-in server (Benchmarks/standin.py), then check that
+they split the work: every submission downloaded exactly once and index.idx
+holding every view id once, in whole lines.
+
+ python3 Benchmarks/multi_node.py [--nodes N] [--mode shard|claims]
+                                  [--category CATEGORY] [stand-in options]
+                                  [-- furaffinity-dl options]
+
+e.g. python3 Benchmarks/multi_node.py --nodes 4 --mode claims --users koul,mylafox
+"""
+
+import collections
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from Benchmarks.standin import arguments  # noqa: E402
+from Benchmarks.standin import Site  # noqa: E402
+
+
+def take(argv, name, default):
+    """Remove an option of this script from argv, return its value"""
+    if name not in argv:
+        return default
+    index = argv.index(name)
+    value = argv[index + 1]
+    del argv[index : index + 2]
+    return value
+
+
+argv = sys.argv[1:]
+extra = []
+if "--" in argv:
+    argv, extra = argv[: argv.index("--")], argv[argv.index("--") + 1 :]
+nodes = int(take(argv, "--nodes", 3))
+mode = take(argv, "--mode", "claims")
+category = take(argv, "--category", "gallery")
+options = arguments(argv)
+if "--port" not in argv:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        options.port = s.getsockname()[1]
+    argv += ["--port", str(options.port)]
+
+server = subprocess.Popen(
+    [sys.executable, f"{root}/Benchmarks/standin.py", *argv], stdout=subprocess.DEVNULL
+)
+base_url = f"http://127.0.0.1:{options.port}"
+for _ in range(100):
+    try:
+        urllib.request.urlopen(f"{base_url}/gallery/{options.users.split(',')[0]}/999/")
+        break
+    except OSError:
+        time.sleep(0.1)
+
+output = tempfile.mkdtemp()
+try:
+    started = time.perf_counter()
+    processes = []
+    for number in range(1, nodes + 1):
+        command = [
+            sys.executable,
+            f"{root}/furaffinity-dl.py",
+            "--base-url",
+            base_url,
+            "--output",
+            output,
+            "--node",
+            f"node{number}",
+            "--event-log",
+            f"{output}/events.node{number}.jsonl",
+            "--progress",
+            "quiet",
+            *(
+                ["--shard", f"{number}/{nodes}"]
+                if mode == "shard"
+                else ["--claims", f"{output}/claims.sqlite3"]
+            ),
+            *extra,
+            options.users.replace(",", " "),
+            category,
+        ]
+        processes.append(
+            subprocess.Popen(command, cwd=output, stdout=subprocess.DEVNULL)
+        )
+    statuses = [process.wait() for process in processes]
+    elapsed = time.perf_counter() - started
+
+    downloads: collections.Counter[str] = collections.Counter()
+    per_node: collections.Counter[str] = collections.Counter()
+    for number in range(1, nodes + 1):
+        with open(f"{output}/events.node{number}.jsonl", encoding="utf-8") as f:
+            for line in f:
+                event = json.loads(line)
+                if event["event"] == "download":
+                    downloads[event["url"]] += 1
+                    per_node[event["node"]] += 1
+    with open(f"{output}/index.idx", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    indexed = collections.Counter(lines)
+
+    # what the stand-in lists for these users and category
+    site = Site(options)
+    expected = sum(
+        len(site.listings[(category, user)])
+        for user in site.users
+        if (category, user) in site.listings
+    )
+    twice = sum(1 for times in downloads.values() if times > 1)
+    torn = [line for line in lines if not re.fullmatch(r"\(\d+\)", line)]
+    print(
+        f"{elapsed:.1f}s, {nodes} nodes ({mode}): "
+        + ", ".join(f"{node} {number}" for node, number in sorted(per_node.items()))
+    )
+    print(
+        f"{len(downloads)} of {expected} submissions downloaded, "
+        f"{twice} more than once, "
+        f"{len(indexed)} indexed, {sum(indexed.values()) - len(indexed)} duplicate and "
+        f"{len(torn)} torn index lines"
+        + (f", exit statuses {statuses}" if any(statuses) else "")
+    )
+finally:
+    server.terminate()
+    shutil.rmtree(output)
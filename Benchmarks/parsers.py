@@ -0,0 +1,62 @@
+"""Compare the --parser backends on the saved pages in Benchmarks/fixtures:
+time to parse a view page (with and without --metadata) and a gallery page,
+and check that every backend extracts the same records.
+
+ python3 Benchmarks/parsers.py [rounds]
+"""
+
+import dataclasses
+import os
+import sys
+import time
+
+from bs4 import FeatureNotFound
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.argv = [sys.argv[0]]
+
+import Modules.config as config  # noqa: E402
+from Modules.parser import parse_listing  # noqa: E402
+from Modules.parser import parse_submission  # noqa: E402
+
+with open(f"{root}/Benchmarks/fixtures/view.html", encoding="utf-8") as f:
+    view = f.read()
+with open(f"{root}/Benchmarks/fixtures/gallery.html", encoding="utf-8") as f:
+    gallery = f.read()
+
+
+def timed(function, *args):
+    function(*args)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = function(*args)
+    return (time.perf_counter() - started) / rounds * 1000, result
+
+
+config.json_description = True
+results = {}
+print(f"{'backend':<12} {'view':>9} {'view+meta':>10} {'gallery':>9}")
+for backend in ("html.parser", "lxml", "selectolax"):
+    config.parser_backend = backend
+    try:
+        config.metadata = False
+        view_ms, _ = timed(parse_submission, view, "/view/54321098/")
+        config.metadata = True
+        meta_ms, record = timed(parse_submission, view, "/view/54321098/")
+        gallery_ms, page = timed(parse_listing, gallery)
+    except (ImportError, FeatureNotFound) as e:
+        print(f"{backend:<12} not installed ({e})")
+        continue
+    print(f"{backend:<12} {view_ms:>7.2f}ms {meta_ms:>8.2f}ms {gallery_ms:>7.2f}ms")
+    # html descriptions are serialized differently by each library
+    results[backend] = (
+        dataclasses.replace(record, description_html=None),
+        page,
+    )
+
+reference = results.pop("html.parser")
+for backend, result in results.items():
+    print(f"{backend} matches html.parser: {result == reference}")
@@ -0,0 +1,289 @@
+"""A local stand-in for furaffinity to benchmark against without touching the
+real site.
+
+Listings and view pages are the recorded pages in Benchmarks/fixtures with
+synthetic submissions put in: gallery, scraps and favorites (with /next
+cursors) of every user, a no-images page past the last one, and every
+--notice-every'th view page a "not in our database" notice instead of the
+submission. Media files are generated, with ETag and Range support.
+
+ python3 Benchmarks/standin.py [--port PORT] [--users koul,...] [--submissions N]
+                               [--latency SECONDS] [--error-rate P] ...
+
+then e.g. python3 furaffinity-dl.py --base-url http://127.0.0.1:PORT koul
+"""
+
+import argparse
+import random
+import re
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from os.path import abspath
+from os.path import dirname
+
+FIXTURES = f"{dirname(abspath(__file__))}/fixtures"
+RATINGS = ("general", "mature", "adult")
+TYPES = ("image", "image", "image", "text", "music", "flash")
+FAVE_BASE = 1_500_000_000
+NEXT_BUTTON = (
+    r'<form action="[^"]*" method="get"><button class="button standard" '
+    r'type="submit">Next</button></form>'
+)
+
+
+def arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument("--users", default="koul", help="comma separated usernames")
+    parser.add_argument(
+        "--submissions", default=200, type=int, help="gallery submissions per user"
+    )
+    parser.add_argument("--per-page", default=48, type=int)
+    parser.add_argument(
+        "--media-size", default=512, type=int, help="average file size in KiB"
+    )
+    parser.add_argument(
+        "--latency", default=0, type=float, help="seconds added to every response"
+    )
+    parser.add_argument(
+        "--error-rate", default=0, type=float, help="share of requests answered 503"
+    )
+    parser.add_argument(
+        "--notice-every",
+        default=0,
+        type=int,
+        help="answer every n-th view page with a system message, 0 for none",
+    )
+    parser.add_argument("--seed", default=0, type=int)
+    return parser.parse_args(argv)
+
+
+def template(html):
+    """Escape html for str.format"""
+    return html.replace("{", "{{").replace("}", "}}")
+
+
+class Site:
+    """The pages and files of the stand-in, built once from the fixtures"""
+
+    def __init__(self, options):
+        self.options = options
+        self.users = options.users.split(",")
+        with open(f"{FIXTURES}/gallery.html", encoding="utf-8") as f:
+            gallery = f.read()
+        with open(f"{FIXTURES}/view.html", encoding="utf-8") as f:
+            view = f.read()
+
+        section = re.search(r'<section id="gallery-gallery"[^>]*>', gallery)
+        end = gallery.index("</section>", section.end())
+        head, tail = gallery[: section.start()], gallery[end + len("</section>") :]
+        self.listing_head = gallery[: section.end()]
+        self.listing_tail = re.sub(NEXT_BUTTON, "{next}", template(gallery[end:]))
+        tail = re.sub(NEXT_BUTTON, "", tail)
+        self.no_images = (
+            head
+            + '<div id="no-images" class="aligncenter">'
+            + "There are no submissions to list</div>"
+            + tail
+        )
+        self.notice = (
+            head
+            + '<section class="aligncenter notice-message"><div class="section-body '
+            + 'alignleft"><div class="redirect-message">The submission you are trying '
+            + "to find is not in our database.</div></div></section>"
+            + tail
+        )
+
+        view = view.replace(
+            "//d.furaffinity.net/art/koul/1704103200/1704103200.koul_sunset_fox.png",
+            "//HOST/art/USER/VIEW_ID/VIEW_ID.USER_SLUG.png",
+        )
+        view = template(view)
+        for old, new in (
+            ("Sunset Fox", "{title}"),
+            ("54321098", "{view_id}"),
+            ('general">General<', '{rating}">{rating_name}<'),
+            ("HOST", "{host}"),
+            ("VIEW_ID", "{view_id}"),
+            ("SLUG", "{slug}"),
+            ("USER", "{user}"),
+            ("koul", "{user}"),
+            ("Koul", "{user_name}"),
+        ):
+            view = view.replace(old, new)
+        self.view = view
+
+        # the same random bytes for every file, each one a slice of them
+        rng = random.Random(options.seed)
+        self.media = rng.randbytes(options.media_size * 1024 * 2)
+        self.submissions = {}
+        self.listings = {}
+        for number, user in enumerate(self.users):
+            base = 50_000_000 + number * 1_000_000
+            gallery_ids = [base + i for i in range(options.submissions, 0, -1)]
+            scraps_ids = [
+                base + 500_000 + i for i in range(options.submissions // 4, 0, -1)
+            ]
+            for view_id in gallery_ids + scraps_ids:
+                self.submissions[view_id] = user
+            self.listings[("gallery", user)] = gallery_ids
+            self.listings[("scraps", user)] = scraps_ids
+        for number, user in enumerate(self.users):
+            # faves of the next user's gallery, oldest fave last
+            other = self.users[(number + 1) % len(self.users)]
+            self.listings[("favorites", user)] = self.listings[("gallery", other)][::2]
+
+    def listing(self, category, user, page=None, cursor=None):
+        items = self.listings[(category, user)]
+        per_page = self.options.per_page
+        start = (page - 1) * per_page if cursor is None else FAVE_BASE - cursor + 1
+        shown = items[start : start + per_page]
+        if start < 0 or not shown:
+            return self.no_images
+        figures = "".join(self.figure(view_id, user) for view_id in shown)
+        next_button = ""
+        if start + per_page < len(items):
+            if category == "favorites":
+                action = f"/favorites/{user}/{FAVE_BASE - (start + per_page - 1)}/next"
+            else:
+                action = f"/{category}/{user}/{page + 1}/"
+            next_button = (
+                f'<form action="{action}" method="get"><button class="button '
+                'standard" type="submit">Next</button></form>'
+            )
+        return self.listing_head + figures + self.listing_tail.format(next=next_button)
+
+    def figure(self, view_id, user):
+        rating = RATINGS[view_id % 3]
+        kind = TYPES[view_id % len(TYPES)]
+        title = f"Submission {view_id}"
+        return (
+            f'<figure id="sid-{view_id}" class="r-{rating} t-{kind} u-{user}"><b><u>'
+            f'<a href="/view/{view_id}/"><img alt="" src="//t.furaffinity.net/'
+            f'{view_id}@200-1704103200.jpg" data-width="200" data-height="150" '
+            f'style="width:200px; height:150px"></a></u></b>\n<figcaption><p><a '
+            f'href="/view/{view_id}/" title="{title}">{title}</a></p><p><i>by</i> '
+            f'<a href="/user/{user}/" title="{user}">{user}</a></p></figcaption>'
+            "</figure>\n"
+        )
+
+    def submission(self, view_id, host):
+        user = self.submissions.get(view_id)
+        every = self.options.notice_every
+        if user is None or (every and view_id % every == 0):
+            return None
+        rating = RATINGS[view_id % 3]
+        return self.view.format(
+            title=f"Submission {view_id}",
+            view_id=view_id,
+            rating=rating,
+            rating_name=rating.capitalize(),
+            host=host,
+            slug=f"submission_{view_id}",
+            user=user,
+            user_name=user.capitalize(),
+        )
+
+    def file_size(self, view_id):
+        size = self.options.media_size * 1024
+        return size // 2 + zlib.crc32(str(view_id).encode()) % size
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, with Nagle every kept-alive
+    # response would wait ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+    site = None
+
+    def log_message(self, *args):
+        pass
+
+    def send(
+        self, status, body=b"", content_type="text/html; charset=UTF-8", headers=()
+    ):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        options = self.site.options
+        if options.latency:
+            time.sleep(options.latency)
+        if options.error_rate and random.random() < options.error_rate:
+            self.send(503, "Service Temporarily Unavailable")
+            return
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if not parts:
+            self.send(200, self.site.no_images)
+        elif parts[0] in ("gallery", "scraps", "favorites") and len(parts) > 1:
+            self.list(parts)
+        elif parts[0] == "view" and len(parts) > 1 and parts[1].isdigit():
+            page = self.site.submission(int(parts[1]), self.headers["Host"])
+            self.send(200, page if page is not None else self.site.notice)
+        elif parts[0] == "art" and len(parts) > 2 and parts[2].isdigit():
+            self.file(int(parts[2]))
+        else:
+            self.send(404, "Not Found")
+
+    def list(self, parts):
+        category, user = parts[0], parts[1]
+        if (category, user) not in self.site.listings:
+            self.send(200, self.site.notice)
+        elif len(parts) > 3 and parts[3] == "next" and parts[2].isdigit():
+            self.send(200, self.site.listing(category, user, cursor=int(parts[2])))
+        else:
+            page = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 1
+            self.send(200, self.site.listing(category, user, page))
+
+    def file(self, view_id):
+        if view_id not in self.site.submissions:
+            self.send(404, "Not Found")
+            return
+        size = self.site.file_size(view_id)
+        start = view_id % 1024
+        body = memoryview(self.site.media)[start : start + size]
+        etag = f'"{view_id}"'
+        headers = [("ETag", etag), ("Last-Modified", "Mon, 01 Jan 2024 10:00:00 GMT")]
+        if self.headers.get("If-None-Match") == etag:
+            self.send(304, headers=headers)
+            return
+        requested = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if requested and self.headers.get("If-Range", etag) == etag:
+            offset = int(requested.group(1))
+            if offset >= size:
+                self.send(416, headers=[("Content-Range", f"bytes */{size}")])
+                return
+            headers.append(("Content-Range", f"bytes {offset}-{size - 1}/{size}"))
+            self.send(206, body[offset:], "image/png", headers)
+            return
+        self.send(200, body, "image/png", headers)
+
+
+def serve(options):
+    Handler.site = Site(options)
+    server = ThreadingHTTPServer(("127.0.0.1", options.port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    options = arguments()
+    server = serve(options)
+    print(f"Serving a furaffinity stand-in on http://127.0.0.1:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,473 @@
+import asyncio
+import contextlib
+import http.cookiejar as cookielib
+import os
+import time
+
+import aiohttp
+
+import Modules.config as config
+from Modules.cluster import lease
+from Modules.cluster import print_progress
+from Modules.cluster import release
+from Modules.cluster import renew
+from Modules.cluster import renewal_due
+from Modules.download import already_downloaded
+from Modules.download import check_verified_file
+from Modules.download import chunk_size
+from Modules.download import conditional_headers
+from Modules.download import downloaded_submission
+from Modules.download import existing_files
+from Modules.download import file_exists
+from Modules.download import file_exists_fallback
+from Modules.download import finish_file
+from Modules.download import found_submission
+from Modules.download import listed_file
+from Modules.download import part_request_headers
+from Modules.download import read_submission
+from Modules.download import start_part
+from Modules.functions import check_status
+from Modules.functions import crawl_failed
+from Modules.functions import crawled_page
+from Modules.functions import DownloadComplete
+from Modules.functions import DownloadError
+from Modules.journal import add_job
+from Modules.journal import clear_journal
+from Modules.journal import DONE
+from Modules.journal import FAILED
+from Modules.journal import failure_state
+from Modules.journal import IN_PROGRESS
+from Modules.journal import journal_path
+from Modules.journal import PENDING
+from Modules.journal import set_state
+from Modules.listing import Listing
+from Modules.manifest import manifest_jobs
+from Modules.manifest import manifest_key
+from Modules.manifest import progress_key
+from Modules.metrics import count
+from Modules.metrics import gauge
+from Modules.metrics import host
+from Modules.metrics import observe
+from Modules.metrics import print_summary
+from Modules.parser import parse_listing
+from Modules.prefetch import PagePrefetcher
+from Modules.progress import close as close_progress
+from Modules.progress import transfer
+from Modules.ratelimit import get_limiter
+from Modules.ratelimit import parse_retry_after
+from Modules.ratelimit import THROTTLE_STATUSES
+from Modules.retry import retry_delay
+from Modules.store import hold_store_lock
+from Modules.store import link_stored
+from Modules.store import release_store_lock
+from Modules.store import store_file
+
+
+def run_async(crawls, manifest=None):
+    """Crawl and download every (username, category, download_url) crawl with
+    asyncio, then the submissions of a --from-manifest manifest. Return False
+    if a crawl failed or the run was interrupted."""
+    try:
+        failed = asyncio.run(crawl_all(crawls, manifest))
+    except KeyboardInterrupt:
+        print(
+            f"{config.WARN_COLOR}Stopping, unfinished downloads are kept in \
+{journal_path()} for the next run{config.END}"
+        )
+        return False
+    # a failed crawl continues where it stopped next time
+    keys = [
+        progress_key(download_url)
+        for _, _, download_url in crawls
+        if download_url not in failed
+    ]
+    if manifest is not None:
+        keys.append(manifest_key(manifest))
+    clear_journal(keys)
+    return not failed
+
+
+async def crawl_all(crawls, manifest=None):
+    headers = {"User-Agent": config.user_agent}
+    if not config.request_compress:
+        headers["Accept-Encoding"] = "identity"
+    cookies = None
+    if config.cookies is not None:
+        jar = cookielib.MozillaCookieJar(config.cookies)
+        jar.load()
+        cookies = {cookie.name: cookie.value for cookie in jar}
+    connector = aiohttp.TCPConnector(
+        limit=max(config.async_tasks, 1)
+        + max(config.concurrent_crawls, 1) * max(config.prefetch_pages, 1),
+        limit_per_host=max(config.max_connections, 0),
+    )
+
+    async with aiohttp.ClientSession(
+        headers=headers, cookies=cookies, connector=connector
+    ) as session:
+        queue = asyncio.Queue(maxsize=max(config.queue_size, 1))
+        gauge("queue_depth", queue.qsize)
+        # failed downloads waiting for their backoff before going back in queue
+        retrying = set()
+        workers = [
+            asyncio.create_task(worker(session, queue, retrying))
+            for _ in range(max(config.async_tasks, 1))
+        ]
+        jobs = list(reversed(crawls))
+        failed = []
+        await asyncio.gather(
+            *(
+                crawler(session, queue, jobs, failed)
+                for _ in range(max(min(config.concurrent_crawls, len(crawls)), 1))
+            )
+        )
+        if manifest is not None:
+            await queue_manifest(queue, manifest)
+        await queue.join()
+        while retrying:
+            await asyncio.gather(*retrying)
+            await queue.join()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    close_progress()
+    print_summary()
+    print_progress()
+    return failed
+
+
+async def request(session, method, url, **kwargs):
+    """Send a request through the rate limiter, backing off on 429/503"""
+    limiter = get_limiter(url)
+    for attempt in range(6):
+        delay = limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        started = time.monotonic()
+        response = await session.request(method, url, **kwargs)
+        count("http_responses", status=response.status, host=host(url))
+        observe("http_latency_seconds", time.monotonic() - started, host=host(url))
+        if response.status not in THROTTLE_STATUSES or attempt == 5:
+            break
+        limiter.throttled(parse_retry_after(response.headers.get("Retry-After")))
+        print(
+            f"{config.WARN_COLOR}Got a HTTP {response.status} for \
+{url}, slowing down{config.END}"
+        )
+        response.release()
+    if response.status not in THROTTLE_STATUSES:
+        limiter.succeeded()
+    return response
+
+
+async def crawl(session, queue, username, category, download_url):
+    """loop over all pages of download_url and queue their submissions"""
+    listing = Listing(username, category, download_url)
+    crawl_complete = asyncio.Event()
+    # see main() in furaffinity-dl.py
+    slots = asyncio.BoundedSemaphore(
+        max(config.queue_size // max(config.concurrent_crawls, 1), 1)
+    )
+    pages = PagePrefetcher(
+        download_url,
+        lambda page_url: asyncio.create_task(fetch_page(session, page_url)),
+    )
+
+    # the listing keeps its progress in the journal and looks submissions up
+    # in the catalog, both in the output folder that may be on a NAS, so its
+    # steps run in threads
+
+    # work left behind by an interrupted run
+    for path in await asyncio.to_thread(listing.resume):
+        await queue_download(queue, path, category, listing.key, crawl_complete, slots)
+
+    try:
+        while (
+            page_num := await asyncio.to_thread(listing.next_page, crawl_complete)
+        ) is not None:
+            page = await pages.fetch(page_num, listing.look_ahead)
+            submissions = listing.submissions(page)
+            while (
+                item := await asyncio.to_thread(next, submissions, None)
+            ) is not None:
+                await queue_download(
+                    queue, item.path, category, listing.key, crawl_complete, slots
+                )
+                await asyncio.sleep(config.interval)
+    except DownloadComplete:
+        listing.stop(complete=True)
+    finally:
+        pages.close()
+    await asyncio.to_thread(listing.finish)
+
+
+async def fetch_page(session, page_url):
+    async with await request(session, "GET", page_url) as response:
+        check_status(page_url, response.status)
+        page = parse_listing(await response.text())
+    crawled_page(page_url, response.status, page)
+    return page
+
+
+async def queue_download(queue, path, category, key, crawl_complete, slots):
+    await asyncio.to_thread(add_job, path, category, key)
+    await slots.acquire()
+    await queue.put((path, category, crawl_complete, slots, 0))
+
+
+async def queue_manifest(queue, manifest):
+    """queue the submissions of a --crawl-only manifest"""
+    key = manifest_key(manifest)
+    crawl_complete = asyncio.Event()
+    slots = asyncio.BoundedSemaphore(max(config.queue_size, 1))
+    try:
+        for path, category in manifest_jobs(manifest):
+            if crawl_complete.is_set():
+                break
+            await queue_download(queue, path, category, key, crawl_complete, slots)
+    except DownloadComplete:
+        pass
+
+
+async def crawler(session, queue, jobs, failed):
+    """see crawler() in furaffinity-dl.py"""
+    while jobs:
+        username, category, download_url = jobs.pop()
+        if username is not None:
+            print(f'{config.SUCCESS_COLOR}Now downloading "{username}"{config.END}')
+            print(f"Downloading page {config.start} - {download_url}/{config.start}")
+        try:
+            await crawl(session, queue, username, category, download_url)
+        except Exception as e:
+            crawl_failed(download_url, e)
+            failed.append(download_url)
+            continue
+        if username is not None:
+            print(
+                f'{config.SUCCESS_COLOR}Finished \
+downloading "{username}"{config.END}'
+            )
+
+
+async def worker(session, queue, retrying):
+    while True:
+        path, category, crawl_complete, slots, attempt = await queue.get()
+        delay = None
+        try:
+            delay = await download_job(session, path, category, attempt)
+        except DownloadComplete:
+            # --check found an already downloaded file
+            crawl_complete.set()
+        except Exception as e:
+            # e.g. the journal or --claims database stayed locked, the job is
+            # left in the journal for the next run
+            print(
+                f"{config.ERROR_COLOR}exception when download {config.BASE_URL}{path}, \
+error {e}{config.END}"
+            )
+        finally:
+            if delay is not None:
+                # the retry keeps its crawl's queue slot and --claims lease
+                # while it waits
+                task = asyncio.create_task(
+                    requeue(
+                        queue,
+                        delay,
+                        (path, category, crawl_complete, slots, attempt + 1),
+                    )
+                )
+                retrying.add(task)
+                task.add_done_callback(retrying.discard)
+            else:
+                slots.release()
+            queue.task_done()
+
+
+async def download_job(session, path, category, attempt=0):
+    """asyncio counterpart of download_job in furaffinity-dl.py"""
+    leased = False
+    done = False
+    delay = None
+    try:
+        # --claims lives on shared storage and may wait on other nodes' locks
+        if not await asyncio.to_thread(lease, path):
+            # another node downloads it, nothing left to do here
+            count("submissions_skipped", reason="claimed")
+            await asyncio.to_thread(set_state, path, DONE)
+            return None
+        leased = True
+        await asyncio.to_thread(set_state, path, IN_PROGRESS)
+        await download(session, path, category=category)
+        done = True
+    except asyncio.CancelledError:
+        # the run is stopping, no need to keep the loop going meanwhile
+        set_state(path, PENDING)
+        raise
+    except DownloadComplete:
+        done = True
+        raise
+    except DownloadError as e:
+        delay = retry_delay(e, path, attempt)
+        state = failure_state(e) if delay is None else PENDING
+        await asyncio.to_thread(set_state, path, state)
+        return delay
+    except Exception as e:
+        print(
+            f"{config.ERROR_COLOR}exception when download {config.BASE_URL}{path}, \
+error {e}{config.END}"
+        )
+        await asyncio.to_thread(set_state, path, FAILED)
+        return None
+    finally:
+        if done:
+            await asyncio.to_thread(set_state, path, DONE)
+        if delay is not None:
+            await asyncio.to_thread(renew, int(path.split("/")[-2]), delay)
+        elif leased:
+            await asyncio.to_thread(release, path, done)
+    return None
+
+
+async def requeue(queue, delay, job):
+    await asyncio.sleep(delay)
+    await queue.put(job)
+
+
+async def download(session, path, category=None):
+    """asyncio counterpart of Modules.download.download"""
+    view_url = f"{config.BASE_URL}{path}"
+    entry = listed_file(path, category)
+    if entry is not None and await verify_file(
+        session, entry["id"], entry["path"], entry["image_url"]
+    ):
+        return already_downloaded(os.path.basename(entry["path"]))
+    try:
+        async with await request(session, "GET", view_url) as response:
+            check_status(view_url, response.status)
+            html = await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise DownloadError(f"exception when download {view_url}, error {e}") from e
+    submission = read_submission(html, path, category)
+    if submission is None:
+        return True
+    if config.dry_run:
+        return found_submission(path, submission)
+
+    if config.check_file_size and file_exists(submission):
+        await verify_files(session, submission)
+
+    # the catalog and index.idx are written under --node file locks
+    if config.dont_redownload is True and file_exists(submission):
+        return await asyncio.to_thread(file_exists_fallback, submission)
+
+    async with store_lock(submission["view_id"]):
+        # hashes the stored copy, or copies it without hardlinks
+        if not await asyncio.to_thread(link_stored, submission, category):
+            await download_file(
+                session,
+                submission["image_url"],
+                view_url,
+                submission["output_path"],
+                submission["desc"],
+                submission["view_id"],
+            )
+            # hashes the whole file
+            await asyncio.to_thread(
+                store_file, submission["view_id"], submission["output_path"], category
+            )
+            count("submissions_downloaded")
+    return await asyncio.to_thread(downloaded_submission, path, submission)
+
+
+@contextlib.asynccontextmanager
+async def store_lock(view_id):
+    """store_lock for the async engine, with an asyncio.Lock"""
+    if not config.store:
+        yield
+        return
+    lock = hold_store_lock(view_id, asyncio.Lock)
+    try:
+        async with lock:
+            yield
+    finally:
+        release_store_lock(view_id)
+
+
+async def download_file(session, url, view_url, file_name, desc, view_id=None):
+    part = f"{file_name}.part"
+    offset, headers = part_request_headers(file_name)
+    started = time.monotonic()
+    written = 0
+    try:
+        async with await request(session, "GET", url, headers=headers) as r:
+            resume = await asyncio.to_thread(
+                start_part,
+                file_name,
+                url,
+                view_url,
+                r.status,
+                r.headers,
+                offset,
+                view_id,
+            )
+            if resume is None:
+                return True
+            offset, total = resume
+            headers = r.headers
+            renewed = started
+            # blocks on slow output folders like the rest of the file I/O
+            file = await asyncio.to_thread(open, part, "ab" if offset else "wb")
+            with file, transfer(desc, total, offset) as bar:
+                async for data in r.content.iter_chunked(chunk_size(total)):
+                    size = await asyncio.to_thread(file.write, data)
+                    written += size
+                    bar.update(size)
+                    if view_id is not None and renewal_due(renewed):
+                        await asyncio.to_thread(renew, view_id)
+                        renewed = time.monotonic()
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+        raise DownloadError(
+            f"Download {file_name} ({view_url}) failed, error {e}. \
+Keeping partial file to resume..."
+        ) from e
+    finally:
+        count("bytes_downloaded", written)
+
+    return await asyncio.to_thread(
+        finish_file, file_name, url, view_url, total, headers, written, started, view_id
+    )
+
+
+async def verify_files(session, submission):
+    """asyncio counterpart of Modules.download.verify_files"""
+    for file_name in existing_files(submission):
+        await verify_file(
+            session, submission["view_id"], file_name, submission["image_url"]
+        )
+
+
+async def verify_file(session, view_id, file_name, image_url):
+    headers = conditional_headers(view_id, file_name)
+    try:
+        async with await request(
+            session,
+            "GET" if headers else "HEAD",
+            image_url,
+            headers=headers,
+        ) as r:
+            status, response_headers = r.status, r.headers
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        print(
+            f"{config.ERROR_COLOR}Can not check file size for \
+{image_url}...{config.END}"
+        )
+        return True
+    return await asyncio.to_thread(
+        check_verified_file,
+        view_id,
+        file_name,
+        image_url,
+        status,
+        response_headers,
+        bool(headers),
+    )
@@ -0,0 +1,79 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+
+import Modules.config as config
+from Modules.cluster import file_lock
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_catalog_lines = 0
+_catalog_file = None
+
+
+def catalog_path():
+    return f"{config.output_folder}/catalog.jsonl"
+
+
+def load_catalog():
+    """Read catalog.jsonl once, it maps view ids to what we know about their
+    downloaded file (path, size, ETag, Last-Modified, ...)"""
+    global _catalog, _catalog_lines
+    if _catalog is not None:
+        return _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            entries = {}
+            with contextlib.suppress(FileNotFoundError):
+                with open(catalog_path(), encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # torn last line after a crash
+                        entries.setdefault(entry["id"], {}).update(entry)
+                        _catalog_lines += 1
+            _catalog = entries
+            atexit.register(close_catalog)
+    return _catalog
+
+
+def get_entry(view_id):
+    return load_catalog().get(int(view_id))
+
+
+def update_entry(view_id, **fields):
+    """Merge fields into the view id's entry and append them to catalog.jsonl"""
+    global _catalog_file, _catalog_lines
+    catalog = load_catalog()
+    fields["id"] = int(view_id)
+    line = json.dumps(fields, ensure_ascii=False) + "\n"
+    with _catalog_lock:
+        catalog.setdefault(fields["id"], {}).update(fields)
+        if _catalog_file is None:
+            _catalog_file = open(catalog_path(), encoding="utf-8", mode="a+")
+        with file_lock(catalog_path()):
+            _catalog_file.write(line)
+            _catalog_file.flush()
+        _catalog_lines += 1
+
+
+def close_catalog():
+    """Close catalog.jsonl, rewriting it with one line per view id when most
+    of its lines are outdated updates"""
+    global _catalog_file, _catalog_lines
+    with _catalog_lock:
+        if _catalog_file is not None:
+            _catalog_file.close()
+            _catalog_file = None
+        # other nodes may still be appending to the file that would be replaced
+        if _catalog and _catalog_lines > 2 * len(_catalog) and config.node is None:
+            with open(f"{catalog_path()}.tmp", encoding="utf-8", mode="w") as f:
+                for entry in _catalog.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{catalog_path()}.tmp", catalog_path())
+            _catalog_lines = len(_catalog)
@@ -0,0 +1,190 @@
+"""Splitting one run across several machines that share the output folder.
+
+--shard I/N gives every machine a fixed part of the submissions, by a hash of
+the view id that is the same everywhere: each one still crawls the listings
+but only downloads the submissions of its shard. --claims DATABASE splits
+them as they come instead: before downloading a submission a machine leases
+it in a SQLite database on the shared storage, and skips it if another one
+holds the lease or already downloaded it. A lease that isn't renewed within
+--lease seconds (a machine that crashed) can be taken over; long downloads
+and retries waiting for their backoff renew theirs.
+
+Every machine is a --node with its own journal and sync marks, and appends to
+index.idx and catalog.jsonl under a lock file so that their lines don't
+interleave.
+"""
+
+import atexit
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import TextIO
+
+import Modules.config as config
+
+try:
+    import fcntl
+except ImportError:  # Windows, appends aren't locked there
+    fcntl = None  # type: ignore[assignment]
+
+LEASED = "leased"
+DONE = "done"
+
+_claims = None
+_claims_lock = threading.Lock()
+_lock_files: dict[str, TextIO] = {}
+_lock_files_lock = threading.Lock()
+
+
+def node_file(name):
+    """Path of a state file in the output folder, one per --node"""
+    if config.node is None:
+        return f"{config.output_folder}/{name}"
+    stem, extension = os.path.splitext(name)
+    return f"{config.output_folder}/{stem}.{config.node}{extension}"
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path.lock while several nodes write to path"""
+    if config.node is None or fcntl is None:
+        yield
+        return
+    with _lock_files_lock:
+        lock = _lock_files.get(path)
+        if lock is None:
+            lock = _lock_files[path] = open(f"{path}.lock", "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def in_shard(view_id):
+    """Return False if view id belongs to another machine's --shard"""
+    if config.shard is None:
+        return True
+    shard, shards = config.shard
+    return zlib.crc32(str(view_id).encode()) % shards == shard - 1
+
+
+def load_claims():
+    global _claims
+    if _claims is not None:
+        return _claims
+    with _claims_lock:
+        if _claims is None:
+            # no WAL, it needs memory shared between the machines
+            claims = sqlite3.connect(
+                config.claims, timeout=60, check_same_thread=False, isolation_level=None
+            )
+            claims.execute(
+                "CREATE TABLE IF NOT EXISTS claims (view_id INTEGER PRIMARY KEY, "
+                "node TEXT, state TEXT, expires REAL)"
+            )
+            _claims = claims
+            atexit.register(close_claims)
+    return _claims
+
+
+def view_id(path):
+    return int(path.split("/")[-2])
+
+
+def lease(path):
+    """Lease a submission for this node, return False if another node holds
+    it or downloaded it already"""
+    if config.claims is None or config.dry_run:
+        return True
+    claims = load_claims()
+    now = time.time()
+    with _claims_lock:
+        claims.execute("BEGIN IMMEDIATE")
+        try:
+            row = claims.execute(
+                "SELECT node, state, expires FROM claims WHERE view_id = ?",
+                (view_id(path),),
+            ).fetchone()
+            if row is not None and (
+                row[1] == DONE or (row[0] != config.node and row[2] > now)
+            ):
+                return False
+            claims.execute(
+                "INSERT OR REPLACE INTO claims VALUES (?, ?, ?, ?)",
+                (view_id(path), config.node, LEASED, now + config.lease),
+            )
+            return True
+        finally:
+            claims.execute("COMMIT")
+
+
+def renew(view_id, wait=0):
+    """Extend this node's lease of view id to --lease seconds from now, plus
+    the wait seconds before its next download attempt"""
+    if config.claims is None or config.dry_run:
+        return
+    claims = load_claims()
+    with _claims_lock:
+        claims.execute(
+            "UPDATE claims SET expires = ? "
+            "WHERE view_id = ? AND node = ? AND state = ?",
+            (time.time() + wait + config.lease, int(view_id), config.node, LEASED),
+        )
+
+
+def renewal_due(renewed):
+    """Return True if a download that renewed its lease at time.monotonic()
+    renewed should renew it again, every third of --lease"""
+    return config.claims is not None and time.monotonic() - renewed > config.lease / 3
+
+
+def release(path, done=False):
+    """Mark a leased submission downloaded, or give it back to the others"""
+    if config.claims is None or config.dry_run:
+        return
+    claims = load_claims()
+    with _claims_lock:
+        if done:
+            claims.execute(
+                "UPDATE claims SET state = ? WHERE view_id = ? AND node = ?",
+                (DONE, view_id(path), config.node),
+            )
+        else:
+            claims.execute(
+                "DELETE FROM claims WHERE view_id = ? AND node = ? AND state = ?",
+                (view_id(path), config.node, LEASED),
+            )
+
+
+def progress():
+    """Summarize the claims of every node, e.g. "a: 30 done, b: 28 done, 2 leased" """
+    if config.claims is None or config.dry_run:
+        return None
+    claims = load_claims()
+    with _claims_lock:
+        rows = claims.execute(
+            "SELECT node, state, COUNT(*) FROM claims "
+            "GROUP BY node, state ORDER BY node"
+        ).fetchall()
+    nodes = {}
+    for node, state, number in rows:
+        nodes.setdefault(node, []).append(f"{number} {state}")
+    return ", ".join(f"{node}: {', '.join(states)}" for node, states in nodes.items())
+
+
+def print_progress():
+    line = progress()
+    if line:
+        print(f"{config.SUCCESS_COLOR}Claims of all nodes - {line}{config.END}")
+
+
+def close_claims():
+    global _claims
+    with _claims_lock:
+        if _claims is not None:
+            _claims.close()
+            _claims = None
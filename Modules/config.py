@@ -1,5 +1,20 @@
 import argparse
+import importlib.util
 import os
+from datetime import date
+from typing import Optional
+
+
+def shard_spec(value):
+    """Parse --shard I/N into (I, N)"""
+    try:
+        shard, shards = map(int, value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got {value!r}") from None
+    if not 1 <= shard <= shards:
+        raise argparse.ArgumentTypeError(f"shard {shard} isn't between 1 and {shards}")
+    return shard, shards
+
 
 parser = argparse.ArgumentParser(
     formatter_class=argparse.RawTextHelpFormatter,
@@ -35,8 +50,8 @@ provide them through a file instead)",
 parser.add_argument(
     "category",
     nargs="?",
-    help="the category to download, gallery/scraps/favorites \
-[default: gallery]",
+    help="the category to download, gallery/scraps/favorites or several of \
+them separated by commas [default: gallery]",
     default="gallery",
     type=str,
 )
@@ -54,6 +69,12 @@ parser.add_argument(
     action="store_true",
     help="check and download latest submissions of a user",
 )
+parser.add_argument(
+    "--sync",
+    action="store_true",
+    help="only crawl listing pages until the newest submission seen by the \
+last --sync of the same gallery, kept in sync.json",
+)
 parser.add_argument(
     "--user-agent",
     "-ua",
@@ -63,6 +84,14 @@ Firefox/101.0",
     help="Your browser's user agent, may be required, depending on your luck",
     type=str,
 )
+parser.add_argument(
+    "--base-url",
+    dest="base_url",
+    default="https://www.furaffinity.net",
+    help="site to download from, e.g. a local stand-in server for \
+Benchmarks/end_to_end.py [default: https://www.furaffinity.net]",
+    type=str,
+)
 parser.add_argument(
     "--submissions",
     "-sub",
@@ -99,6 +128,45 @@ parser.add_argument(
     help="delay between downloading pages in seconds [default: 0]",
     type=int,
 )
+parser.add_argument(
+    "--rate-limit",
+    dest="rate_limit",
+    default=0,
+    help="maximum page requests per second to furaffinity, shared by all \
+threads [default: 0, unlimited]",
+    type=float,
+)
+parser.add_argument(
+    "--media-rate-limit",
+    dest="media_rate_limit",
+    default=0,
+    help="maximum file requests per second to the media server, shared by all \
+threads [default: 0, unlimited]",
+    type=float,
+)
+parser.add_argument(
+    "--max-connections",
+    dest="max_connections",
+    default=0,
+    help="maximum concurrent connections to each of furaffinity and its media \
+server [default: 0, unlimited]",
+    type=int,
+)
+parser.add_argument(
+    "--retries",
+    default=5,
+    help="how many times a submission is retried after a network or server \
+error [default: 5]",
+    type=int,
+)
+parser.add_argument(
+    "--retry-backoff",
+    dest="retry_backoff",
+    default=2,
+    help="seconds to wait before the first retry, doubled for every further \
+one [default: 2]",
+    type=float,
+)
 parser.add_argument(
     "--rating",
     "-r",
@@ -111,6 +179,52 @@ parser.add_argument(
     dest="submission_filter",
     help="enable submission filter",
 )
+parser.add_argument(
+    "--filter-title",
+    dest="filter_title",
+    help="don't download submissions whose title matches this regular \
+expression (case insensitive)",
+    type=str,
+)
+parser.add_argument(
+    "--filter-rating",
+    dest="filter_rating",
+    help="only download submissions of these comma separated ratings, \
+e.g. general,mature",
+    type=str,
+)
+parser.add_argument(
+    "--filter-type",
+    dest="filter_type",
+    help="only download submissions of these comma separated types, \
+e.g. image,text (others are audio, flash, ...)",
+    type=str,
+)
+parser.add_argument(
+    "--min-id",
+    dest="min_id",
+    default=0,
+    help="only download submissions with at least this view id",
+    type=int,
+)
+parser.add_argument(
+    "--max-id",
+    dest="max_id",
+    default=0,
+    help="only download submissions with at most this view id",
+    type=int,
+)
+parser.add_argument(
+    "--since",
+    help="only download submissions posted on or after this date \
+(YYYY-MM-DD), checked on the view page since listings have no dates",
+    type=date.fromisoformat,
+)
+parser.add_argument(
+    "--until",
+    help="only download submissions posted on or before this date (YYYY-MM-DD)",
+    type=date.fromisoformat,
+)
 parser.add_argument(
     "--metadata",
     "-m",
@@ -144,6 +258,26 @@ parser.add_argument(
     action="store_true",
     help="create an index of downloaded files in an output folder",
 )
+parser.add_argument(
+    "--store",
+    action="store_true",
+    help="keep every downloaded file once in OUTPUT/.store and hardlink it into \
+each of gallery/scraps/favorites/folders that lists it instead of downloading \
+it again (copied where hardlinks aren't supported)",
+)
+parser.add_argument(
+    "--dedupe",
+    action="store_true",
+    help="replace identical files in the output folder by hardlinks to one \
+copy in OUTPUT/.store",
+)
+parser.add_argument(
+    "--index-sync-interval",
+    dest="index_sync_interval",
+    default=5,
+    help="how often new index entries are flushed to disk in seconds [default: 5]",
+    type=float,
+)
 parser.add_argument(
     "--real-category",
     dest="real_category",
@@ -177,6 +311,140 @@ parser.add_argument(
     help="how many threads will be used for parallel download [default: 3]",
     type=int,
 )
+parser.add_argument(
+    "--engine",
+    default="threads",
+    choices=["threads", "async"],
+    help="download engine: a pool of --num-threads threads, or asyncio \
+coroutines over one connection pool (requires aiohttp) [default: threads]",
+    type=str,
+)
+parser.add_argument(
+    "--async-tasks",
+    dest="async_tasks",
+    default=100,
+    help="how many submissions the async engine downloads at once [default: 100]",
+    type=int,
+)
+parser.add_argument(
+    "--parser",
+    default="html.parser",
+    choices=["html.parser", "lxml", "selectolax"],
+    help="HTML parser backend, lxml and selectolax are faster but need the \
+lxml or selectolax package [default: html.parser]",
+    type=str,
+)
+parser.add_argument(
+    "--concurrent-crawls",
+    dest="concurrent_crawls",
+    default=1,
+    help="how many users/categories are crawled at the same time, sharing \
+the download threads [default: 1]",
+    type=int,
+)
+parser.add_argument(
+    "--queue-size",
+    dest="queue_size",
+    default=100,
+    help="how many submissions the crawler may queue ahead of the download \
+threads [default: 100]",
+    type=int,
+)
+parser.add_argument(
+    "--prefetch-pages",
+    dest="prefetch_pages",
+    default=1,
+    help="fetch that many numbered gallery/scraps pages at once instead of \
+one after the other [default: 1]",
+    type=int,
+)
+parser.add_argument(
+    "--chunk-size",
+    dest="chunk_size",
+    default=0,
+    help="read downloads in chunks of that many KiB, 0 picks 64 KiB to 1 MiB \
+depending on the file size [default: 0]",
+    type=int,
+)
+parser.add_argument(
+    "--readinto",
+    action="store_true",
+    help="read downloads into a reused buffer instead of allocating every chunk",
+)
+parser.add_argument(
+    "--progress",
+    default="bars",
+    choices=["bars", "aggregate", "quiet"],
+    help="download progress as a bar per file, a single bar for the whole \
+run, or nothing at all [default: bars]",
+    type=str,
+)
+parser.add_argument(
+    "--stats-interval",
+    dest="stats_interval",
+    default=0,
+    help="print a summary of pages, submissions, bytes and errors every that \
+many seconds, 0 to only print it at the end [default: 0]",
+    type=float,
+)
+parser.add_argument(
+    "--event-log",
+    dest="event_log",
+    help="append a JSON line for every crawled page, download, skip and \
+error to this file",
+    type=str,
+)
+parser.add_argument(
+    "--metrics-port",
+    dest="metrics_port",
+    default=0,
+    help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+    type=int,
+)
+parser.add_argument(
+    "--node",
+    help="name of this machine or process when several share the output \
+folder, it keeps its own journal and sync marks, required with --shard and \
+--claims",
+    type=str,
+)
+parser.add_argument(
+    "--shard",
+    metavar="I/N",
+    help="only download the submissions that hash to shard I of N (1 to N), \
+run the other shards on other machines",
+    type=shard_spec,
+)
+parser.add_argument(
+    "--claims",
+    metavar="DATABASE",
+    help="SQLite database on the shared storage in which the machines lease \
+submissions before downloading them, so that none is downloaded twice",
+    type=str,
+)
+parser.add_argument(
+    "--lease",
+    default=900,
+    help="seconds before the lease of a machine that stopped answering can be \
+taken over by another one [default: 900]",
+    type=float,
+)
+parser.add_argument(
+    "--crawl-only",
+    dest="crawl_only",
+    metavar="MANIFEST",
+    help="only crawl the listings and append a JSON line per submission that \
+would be downloaded to MANIFEST, without fetching view pages or files",
+    type=str,
+)
+parser.add_argument(
+    "--from-manifest",
+    dest="from_manifest",
+    metavar="MANIFEST",
+    help="download the submissions of a --crawl-only manifest instead of \
+crawling",
+    type=str,
+)
 parser.add_argument(
     "--dry-run",
     "--dry",
@@ -189,7 +457,8 @@ args = parser.parse_args()
 
 # positional
 username = args.username
-category = args.category
+categories = args.category.split(",")
+category = categories[0]
 
 if username is not None:
     username = username.split(" ")
@@ -206,17 +475,51 @@ cookies: str = args.cookies
 output_folder: str = args.output_folder
 download: int = args.download
 interval: int = args.interval
+rate_limit: float = args.rate_limit
+media_rate_limit: float = args.media_rate_limit
+retries: int = args.retries
+retry_backoff: float = args.retry_backoff
+max_connections: int = args.max_connections
 user_agent: str = args.user_agent
 start: int = args.start
 stop: int = args.stop
 folder: str = args.folder
 num_threads: int = args.num_threads
+queue_size: int = args.queue_size
+concurrent_crawls: int = args.concurrent_crawls
+engine: str = args.engine
+async_tasks: int = args.async_tasks
+parser_backend: str = args.parser
+if parser_backend != "html.parser" and importlib.util.find_spec(parser_backend) is None:
+    # bs4 would only fail on the first page, and every page would be retried
+    parser.error(f"--parser {parser_backend} needs the {parser_backend} package")
+index_sync_interval: float = args.index_sync_interval
+prefetch_pages: int = args.prefetch_pages
+chunk_size: int = args.chunk_size
+readinto: bool = args.readinto
+progress: str = args.progress
+stats_interval: float = args.stats_interval
+event_log: str = args.event_log
+metrics_port: int = args.metrics_port
+shard: tuple = args.shard
+claims: str = args.claims
+lease: float = args.lease
+node: str = args.node
+if node is None and (shard is not None or claims is not None):
+    # a default like the host name would be shared by the processes of one
+    # machine, which would then take each other's leases for their own
+    parser.error("--shard and --claims need a different --node for each process")
+crawl_only: str = args.crawl_only
+from_manifest: str = args.from_manifest
 
 # True\False
 
 login: bool = args.login
 check: bool = args.check
+sync: bool = args.sync
 index: bool = args.index
+store: bool = args.store
+dedupe: bool = args.dedupe
 submissions: bool = args.submissions
 html_description: bool = args.html_description
 json_description: bool = args.json_description
@@ -224,6 +527,17 @@ metadata: bool = args.metadata
 dont_redownload: bool = args.redownload
 rating: bool = args.rating
 submission_filter: bool = args.submission_filter
+filter_title: str = args.filter_title
+filter_rating: Optional[set] = (
+    set(args.filter_rating.lower().split(",")) if args.filter_rating else None
+)
+filter_type: Optional[set] = (
+    set(args.filter_type.lower().split(",")) if args.filter_type else None
+)
+min_id: int = args.min_id
+max_id: int = args.max_id
+since: date = args.since
+until: date = args.until
 real_category: bool = args.real_category
 request_compress: bool = args.request_compress
 check_file_size: bool = args.check_file_size
@@ -242,7 +556,7 @@ ERROR_COLOR = "\033[1;91m"
 END = "\033[0m"
 
 # Globals
-BASE_URL = "https://www.furaffinity.net"
+BASE_URL = args.base_url.rstrip("/")
 username_replace_chars = {
     " ": "",
     "_": "",
@@ -1,68 +1,234 @@
+import contextlib
 import json
 import os
+import re
+import time
+from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
 from pathvalidate import sanitize_filename
-from tqdm import tqdm
 
 import Modules.config as config
+from Modules.catalog import get_entry
+from Modules.catalog import update_entry
+from Modules.cluster import in_shard
+from Modules.cluster import renew
+from Modules.cluster import renewal_due
+from Modules.filters import listing_filter
+from Modules.filters import view_filter
+from Modules.functions import check_status
+from Modules.functions import classify_status
+from Modules.functions import classify_system_message
 from Modules.functions import DownloadComplete
+from Modules.functions import DownloadError
+from Modules.functions import interrupted
+from Modules.functions import LOGIN_REQUIRED
 from Modules.functions import requests_retry_session
-from Modules.functions import system_message_handler
+from Modules.index import add_to_index
+from Modules.index import check_file
+from Modules.metrics import count
+from Modules.metrics import event
+from Modules.metrics import host
+from Modules.metrics import observe
+from Modules.parser import parse_submission
+from Modules.progress import transfer
+from Modules.store import claim_layout
+from Modules.store import forget_stored
+from Modules.store import link_stored
+from Modules.store import store_file
+from Modules.store import store_lock
+from Modules.store import stored_elsewhere
+
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+
+def download(path, category=None):
+    """Download a submission once, raise DownloadError if that failed"""
+    view_url = f"{config.BASE_URL}{path}"
+    entry = listed_file(path, category)
+    if entry is not None and verify_file(
+        entry["id"], entry["path"], entry["image_url"]
+    ):
+        return already_downloaded(os.path.basename(entry["path"]))
+    try:
+        response = requests_retry_session().get(view_url)
+    except Exception as e:
+        raise DownloadError(f"exception when download {view_url}, error {e}") from e
+    check_status(view_url, response.status_code)
+    submission = read_submission(response.text, path, category)
+    if submission is None:
+        return True
+    if config.dry_run:
+        return found_submission(path, submission)
+
+    if config.check_file_size and file_exists(submission):
+        verify_files(submission)
+
+    if config.dont_redownload is True and file_exists(submission):
+        return file_exists_fallback(submission)
+
+    with store_lock(submission["view_id"]):
+        if not link_stored(submission, category):
+            download_file(
+                submission["image_url"],
+                view_url,
+                submission["output_path"],
+                submission["desc"],
+                submission["view_id"],
+            )
+            store_file(submission["view_id"], submission["output_path"], category)
+            count("submissions_downloaded")
+    return downloaded_submission(path, submission)
 
 
-def download(path, max_retries=5):
-    if max_retries <= 0:
-        return False
+def read_submission(html, path, category=None):
+    """Parse a fetched view page into the submission to download, None if it
+    was filtered. Raise DownloadError when the page has a system message
+    instead."""
+    view_url = f"{config.BASE_URL}{path}"
     try:
-        response = requests_retry_session().get(f"{config.BASE_URL}{path}")
+        record = parse_submission(html, path)
+    except (AttributeError, IndexError, ValueError) as e:
+        raise DownloadError(f"unsuccessful download of {view_url}") from e
+
+    # System messages
+    if record.system_message is not None:
+        print(f"{config.WARN_COLOR}System Message: {record.system_message}{config.END}")
+        kind = classify_system_message(record.system_message)
+        if kind == LOGIN_REQUIRED:
+            raise DownloadError(
+                f"unsuccessful download of {view_url}. Maybe you need to log in?", kind
+            )
+        raise DownloadError(f"unsuccessful download of {view_url}", kind)
 
-        s = BeautifulSoup(response.text, "html.parser")
+    reason = view_filter(record)
+    if reason is not None:
+        filtered(record.title, path, reason)
+        return None
+    return prepare_submission(record, category)
 
-        # System messages
-        if s.find(class_="notice-message") is not None:
-            system_message_handler(s)
-        image = s.find(class_="download").find("a").attrs.get("href")
-    except AttributeError:
-        print(
-            f"{config.ERROR_COLOR}unsuccessful download of {config.BASE_URL}{path} remains retries {max_retries}{config.END}"
-        )
-        return download(path, max_retries - 1)
-    except DownloadComplete:
-        print(
-            f"{config.ERROR_COLOR}unsuccessful download of {config.BASE_URL}{path}. Maybe you need to log in?{config.END}"
-        )
+
+def found_submission(path, submission):
+    print(
+        f"{config.SUCCESS_COLOR}[DRY] Found Submission: \
+{submission['desc']}{config.END}"
+    )
+    return finish_submission(path, submission)
+
+
+def downloaded_submission(path, submission):
+    add_to_index(submission["view_id"])
+    return finish_submission(path, submission)
+
+
+def skip_submission(item, username, category=None):
+    """Return True if a listed submission should not be downloaded,
+    raise DownloadComplete when --check reaches already downloaded files.
+
+    Submissions in the index or the catalog are recognised from the listing
+    page alone, so their view page is never fetched. With --check-file-size a
+    cataloged file is kept, to be verified against its stored image url by a
+    download worker (see listed_file) while the crawl goes on. With --store a
+    submission that the crawl's layout doesn't have yet is kept, to be linked
+    from the store.
+    """
+    count("submissions_seen")
+    if not in_shard(item.view_id):
+        count("submissions_skipped", reason="shard")
+        return True
+    reason = listing_filter(item)
+    if reason is not None:
+        return filtered(item.title, item.path, reason)
+
+    if config.dont_redownload is not True:
         return False
-    except Exception as e:
-        print(f"{config.ERROR_COLOR}exception when download {config.BASE_URL}{path} remains retries {max_retries}, error {e}{config.END}")
-        return download(path, max_retries - 1)
+    if not claim_layout(item.view_id, category):
+        count("submissions_skipped")
+        return True
+    downloaded = check_file(item.path) is True or (
+        not config.check_file_size and catalog_file(item.view_id) is not None
+    )
+    # after the lookups: a download of another layout in flight catalogs its
+    # file before it stores it, and indexes it after
+    if config.store and stored_elsewhere(item.view_id, category):
+        return False
+    if downloaded:
+        return already_downloaded(item.title, username)
+    return False
+
 
-    filename = sanitize_filename(image.split("/")[-1:][0])
+def listed_file(path, category=None):
+    """Return the catalog entry of a queued submission if its file only needs
+    --check-file-size verification, which doesn't need the view page"""
+    if config.dont_redownload is not True or not config.check_file_size:
+        return None
+    view_id = int(path.split("/")[-2])
+    if config.store and stored_elsewhere(view_id, category):
+        return None
+    return catalog_file(view_id)
 
-    author = (
-        s.find(class_="submission-id-sub-container")
-        .find("a")
-        .find("strong")
-        .text.replace(".", "._")
+
+def filtered(title, path, reason):
+    count("submissions_filtered")
+    event("filtered", path=path, title=title, reason=reason)
+    print(
+        f'{config.WARN_COLOR}"{title}" was filtered ({reason}) and will not be \
+downloaded - {config.BASE_URL}{path}{config.END}'
     )
+    return True
+
 
-    title = sanitize_filename(
-        str(s.find(class_="submission-title").find("p").contents[0])
+def already_downloaded(title, username=None):
+    if config.check is True:
+        of = f' of "{username}"' if username is not None else ""
+        print(f"{config.SUCCESS_COLOR}Downloaded all recent files{of}{config.END}")
+        raise DownloadComplete
+    count("submissions_skipped")
+    event("skipped", title=title)
+    print(
+        f'{config.WARN_COLOR}Skipping "{title}" since \
+it\'s already downloaded{config.END}'
     )
-    view_id = int(path.split("/")[-2:-1][0])
+    return True
+
+
+def catalog_file(view_id):
+    """Return the catalog entry of view_id if its file is still on disk with
+    the size it was downloaded with, None otherwise"""
+    if config.dry_run:
+        return None
+    entry = get_entry(view_id)
+    if entry is None or not entry.get("path") or not entry.get("image_url"):
+        return None
+    try:
+        if os.path.getsize(entry["path"]) != entry.get("size"):
+            return None
+    except OSError:
+        return None
+    return entry
+
+
+def prepare_submission(record, category=None):
+    """Collect a parsed view page's submission info and where it will be saved,
+    category is the one of the crawl that listed it"""
+    category = category or config.category
+    filename = sanitize_filename(record.image.split("/")[-1:][0])
+    author = record.author.replace(".", "._")
+    title = sanitize_filename(record.title)
+    view_id = record.view_id
 
     output = f"{config.output_folder}/{author}"
-    rating = s.find(class_="rating-box").text.strip()
+    rating = record.rating
 
-    image_url = f"https:{image}"
+    image_url = urljoin(config.BASE_URL, record.image)
+    output_path = output_path_fb = None
 
     if not config.dry_run:
         if config.real_category:
-            real_category = get_image_cateory(s)
-            output = f"{config.output_folder}/{author}/{real_category}"
+            output = f"{config.output_folder}/{author}/{record.real_category}"
         else:
-            if config.category != "gallery":
-                output = f"{config.output_folder}/{author}/{config.category}"
+            if category != "gallery":
+                output = f"{config.output_folder}/{author}/{category}"
             if config.folder is not None:
                 output = f"{config.output_folder}/{author}/folders/{config.folder.split('/')[1]}"
         os.makedirs(output, exist_ok=True)
@@ -74,118 +240,406 @@ def download(path, max_retries=5):
             output_path = f"{output}/{rating}/{title} ({view_id}) - {filename}"
             output_path_fb = f"{output}/{rating}/{title} - {filename}"
 
-        if config.check_file_size and (
-        os.path.isfile(output_path_fb) or os.path.isfile(output_path)
-        ):
-            content_length = get_content_length(image_url)
-            delete_file_if_mismatch_size(output_path_fb, content_length)
-            delete_file_if_mismatch_size(output_path, content_length)
-
-        if config.dont_redownload is True and (
-            os.path.isfile(output_path_fb) or os.path.isfile(output_path)
-        ):
-            return file_exists_fallback(author, title, view_id)
-
-        if (
-        download_file(
-            image_url, f"{config.BASE_URL}{path}", output_path, f"{title} - [{rating}]"
-        )
-        is True
-        ):
-            with open(
-                f"{config.output_folder}/index.idx", encoding="utf-8", mode="a+"
-            ) as idx:
-                idx.write(f"({view_id})\n")
-        else:
-            return download(path, max_retries - 1)
-    else:
-        print(f"{config.SUCCESS_COLOR}[DRY] Found Submission: {title} - [{rating}]{config.END}")
+    return {
+        "view_id": view_id,
+        "author": author,
+        "title": title,
+        "filename": filename,
+        "rating": rating,
+        "image_url": image_url,
+        "output": output,
+        "output_path": output_path,
+        "output_path_fb": output_path_fb,
+        "desc": f"{title} - [{rating}]",
+        "record": record,
+    }
+
+
+def file_exists(submission):
+    return os.path.isfile(submission["output_path_fb"]) or os.path.isfile(
+        submission["output_path"]
+    )
+
 
+def finish_submission(path, submission):
+    """Save metadata of a downloaded submission"""
+    record = submission["record"]
+    title = submission["title"]
+    filename = submission["filename"]
     if config.metadata is True:
         if config.html_description is True:
-            dsc = s.find(class_="submission-description").prettify()
+            dsc = record.description_html
         else:
-            dsc = s.find(class_="submission-description").text.strip().replace("\r\n", "\n")
+            dsc = record.description
         if config.json_description is True:
-            dsc = []
+            dsc = record.description_strings
         data = {
-            "id": view_id,
+            "id": submission["view_id"],
             "filename": filename,
-            "author": author,
-            "date": s.find(class_="popup_date").attrs.get("title"),
+            "author": submission["author"],
+            "date": record.date,
             "title": title,
             "description": dsc,
             "url": f"{config.BASE_URL}{path}",
-            "tags": [],
-            "category": s.find(class_="info").find(class_="category-name").text,
-            "type": s.find(class_="info").find(class_="type-name").text,
-            "species": s.find(class_="info").findAll("div")[2].find("span").text,
-            "gender": s.find(class_="info").findAll("div")[3].find("span").text,
-            "views": int(s.find(class_="views").find(class_="font-large").text),
-            "favorites": int(s.find(class_="favorites").find(class_="font-large").text),
-            "rating": rating,
-            "comments": [],
+            "tags": record.tags or [],
+            "category": record.category,
+            "type": record.type,
+            "species": record.species,
+            "gender": record.gender,
+            "views": record.views,
+            "favorites": record.favorites,
+            "rating": submission["rating"],
+            "comments": record.comments,
         }
-        create_metadata(output, data, s, title, filename)
+        if record.tags is None:
+            print(f'{config.WARN_COLOR}"{title}" has no tags{config.END}')
+        metadata = create_metadata(submission["output"], data, title, filename)
+        if not config.dry_run:
+            update_entry(submission["view_id"], metadata=metadata)
     if config.download is not None:
         print(
             f'{config.SUCCESS_COLOR}File saved as \
-"{output_path}" {config.END}'
+"{submission["output_path"]}" {config.END}'
         )
     return True
 
 
-def download_file(url, view_url, file_name, desc):
+def download_file(url, view_url, file_name, desc, view_id=None):
+    """Download url to file_name through file_name.part, resuming a previous
+    partial download when the server still has the same file. Raise
+    DownloadError if it failed."""
+    part = f"{file_name}.part"
+    offset, headers = part_request_headers(file_name)
+    started = time.monotonic()
+    written = 0
     try:
-        r = requests_retry_session().get(url, stream=True)
-        if r.status_code != 200:
-            print(
-                f'{config.ERROR_COLOR}Got a HTTP {r.status_code} while downloading \
-"{file_name}" ({view_url}) ...skipping{config.END}'
+        with requests_retry_session().get(url, stream=True, headers=headers) as r:
+            resume = start_part(
+                file_name, url, view_url, r.status_code, r.headers, offset, view_id
             )
-            return False
-        total = int(r.headers.get("Content-Length", 0))
-        encoding = r.headers.get('Content-Encoding', '')
-        with open(file_name, "wb") as file, tqdm(
-            desc=desc.ljust(40),
-            total=total,
-            miniters=100,
-            unit="b",
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as bar:
-            for data in r.iter_content(chunk_size=1024):
-                size = file.write(data)
-                bar.update(size)
-    except KeyboardInterrupt:
-        print(f"{config.SUCCESS_COLOR}Finished downloading{config.END}")
-        os.remove(file_name)
-        exit()
+            if resume is None:
+                return True
+            offset, total = resume
+            headers = r.headers
+            renewed = started
+            with open(part, "ab" if offset else "wb") as file, transfer(
+                desc, total, offset
+            ) as bar:
+                for data in iter_chunks(r, chunk_size(total)):
+                    # Ctrl-C: stop here and keep the partial file for the next run
+                    if interrupted.is_set():
+                        raise KeyboardInterrupt
+                    size = file.write(data)
+                    written += size
+                    bar.update(size)
+                    if view_id is not None and renewal_due(renewed):
+                        renew(view_id)
+                        renewed = time.monotonic()
+    except DownloadError:
+        raise
     except Exception as e:
-        os.remove(file_name)
-        print(f"{config.ERROR_COLOR}Download {file_name} ({view_url}) failed, error {e}. Remove file...{config.END}")
-        return False
+        raise DownloadError(
+            f"Download {file_name} ({view_url}) failed, error {e}. \
+Keeping partial file to resume..."
+        ) from e
+    finally:
+        count("bytes_downloaded", written)
+
+    return finish_file(
+        file_name, url, view_url, total, headers, written, started, view_id
+    )
+
+
+def start_part(file_name, url, view_url, status, headers, offset, view_id=None):
+    """Return (offset, total size) to write the response to file_name.part at,
+    None if a 416 showed that it already holds the whole file and it was
+    finished. Raise DownloadError if the response can't be used."""
+    resume = part_resume(status, headers, offset)
+    if resume is None:
+        if status == 416:
+            if finish_part(file_name, url, headers, view_id):
+                return None
+            discard_part(file_name)
+        raise DownloadError(
+            f'Got a HTTP {status} while downloading "{file_name}" ({view_url})',
+            classify_status(status),
+        )
+    if resume[0] == 0:
+        save_part_validators(file_name, headers, resume[1])
+    return resume
+
+
+def finish_file(
+    file_name, url, view_url, total, headers, written, started, view_id=None
+):
+    """Move a downloaded file_name.part into place and remember the file, raise
+    DownloadError if it was incomplete"""
+    if not complete_part(file_name, total, headers.get("Content-Encoding", "")):
+        raise DownloadError(f"Download {file_name} ({view_url}) was incomplete")
+    downloaded_file(file_name, url, written, started)
+    if view_id is not None:
+        record_file(view_id, file_name, url, headers)
+    return True
+
 
+def chunk_size(total):
+    """Return --chunk-size in bytes, or with 0 a size growing with the file
+    from 64 KiB up to 1 MiB"""
+    if config.chunk_size > 0:
+        return config.chunk_size * 1024
+    if not total:
+        return MIN_CHUNK_SIZE
+    return min(max(total // 16, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+
+def iter_chunks(r, size):
+    """Yield the body of a streamed response in chunks of up to size bytes.
+
+    With --readinto the chunks are read into one reused buffer and are only
+    valid until the next one is read. Compressed bodies always go through
+    iter_content, which decodes them.
+    """
+    if (
+        not config.readinto
+        or r.headers.get("Content-Encoding", "identity") != "identity"
+    ):
+        yield from r.iter_content(chunk_size=size)
+        return
+    # urllib3's readinto reads a new bytes object and copies it over, the
+    # http.client response underneath reads straight into the buffer
+    fp = getattr(r.raw, "_fp", None)
+    readinto = fp.readinto if fp is not None else r.raw.readinto
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while True:
+        size = readinto(buffer)
+        if not size:
+            # urllib3 didn't see the end of the body, give the connection back
+            r.raw.release_conn()
+            return
+        yield view[:size]
+
+
+def downloaded_file(file_name, url, written, started):
+    seconds = time.monotonic() - started
+    observe("file_download_seconds", seconds, host=host(url))
+    event("download", file=file_name, url=url, bytes=written, seconds=round(seconds, 3))
+
+
+def part_request_headers(file_name):
+    """Return offset and Range headers to resume file_name.part where it stopped.
+
+    If-Range makes the server send the whole file instead of the rest when it
+    changed since the partial download started.
+    """
+    part = f"{file_name}.part"
+    if config.request_compress or not os.path.isfile(part):
+        return 0, {}
+    try:
+        with open(f"{part}.json", encoding="utf-8") as f:
+            validators = json.load(f)
+    except (OSError, ValueError):
+        return 0, {}
+    etag = validators.get("etag")
+    if etag is not None and etag.startswith("W/"):
+        etag = None  # weak etags can't be used in If-Range
+    validator = etag or validators.get("last_modified")
+    offset = os.path.getsize(part)
+    if offset == 0 or validator is None:
+        return 0, {}
+    return offset, {"Range": f"bytes={offset}-", "If-Range": validator}
+
+
+def part_resume(status, headers, offset):
+    """Return (offset, total size) to continue writing at, None if the response
+    can't be used"""
+    if status == 200:
+        return 0, int(headers.get("Content-Length", 0))
+    if status == 206 and offset:
+        match = re.match(r"bytes (\d+)-\d+/(\d+)", headers.get("Content-Range", ""))
+        if match is not None and int(match[1]) == offset:
+            return offset, int(match[2])
+    return None
+
+
+def save_part_validators(file_name, headers, total):
+    if config.request_compress:
+        return
+    with open(f"{file_name}.part.json", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "total": total,
+            },
+            f,
+        )
+
+
+def complete_part(file_name, total, encoding):
+    """Move a finished file_name.part into place, or discard it on size mismatch"""
+    part = f"{file_name}.part"
     # if webserver doesn't compress file, we should check file size
-    if len(encoding) == 0 and delete_file_if_mismatch_size(file_name, total):
+    if len(encoding) == 0 and delete_file_if_mismatch_size(part, total):
+        discard_part(file_name)
         return False
+    os.replace(part, file_name)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(f"{part}.json")
     return True
 
-def get_content_length(url):
+
+def finish_part(file_name, url, headers, view_id=None):
+    """Move file_name.part into place if a 416 to its Range request means it
+    already holds the whole file, as after a crash right before os.replace,
+    return False if it doesn't"""
+    part = f"{file_name}.part"
     try:
-        with requests_retry_session().get(url, stream=True) as r:
-            if r.status_code != 200:
-                print(
-                    f'{config.ERROR_COLOR}Got a HTTP {r.status_code} while get content length \
-    "{url}" ...return 0{config.END}'
-                )
-                return 0
-            content_length = r.headers.get("Content-Length", 0)
-            return int(content_length)
-    except Exception as e:
-        print(f'{config.ERROR_COLOR}Can not get content length for {url}...{config.END}')
-        pass
-    return 0
+        with open(f"{part}.json", encoding="utf-8") as f:
+            validators = json.load(f)
+        size = os.path.getsize(part)
+    except (OSError, ValueError):
+        return False
+    match = re.fullmatch(r"bytes \*/(\d+)", headers.get("Content-Range", ""))
+    if not validators.get("total") or size != validators["total"]:
+        return False
+    if match is not None and int(match[1]) != size:
+        return False
+    complete_part(file_name, size, "")
+    if view_id is not None:
+        record_file(
+            view_id,
+            file_name,
+            url,
+            {
+                "ETag": validators.get("etag"),
+                "Last-Modified": validators.get("last_modified"),
+            },
+        )
+    return True
+
+
+def discard_part(file_name):
+    for path in (f"{file_name}.part", f"{file_name}.part.json"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def verify_files(submission):
+    """Check already downloaded files against the server, deleting outdated or
+    incomplete ones. This costs one small request per file: a conditional GET
+    when its ETag/Last-Modified are known, HEAD otherwise."""
+    for file_name in existing_files(submission):
+        verify_file(submission["view_id"], file_name, submission["image_url"])
+
+
+def verify_file(view_id, file_name, image_url):
+    """Check one downloaded file against image_url, return False if it was deleted"""
+    headers = conditional_headers(view_id, file_name)
+    try:
+        with requests_retry_session().request(
+            "GET" if headers else "HEAD",
+            image_url,
+            headers=headers,
+            stream=True,
+        ) as r:
+            status, response_headers = r.status_code, r.headers
+    except Exception:
+        print(
+            f"{config.ERROR_COLOR}Can not check file size for \
+{image_url}...{config.END}"
+        )
+        return True
+    return check_verified_file(
+        view_id, file_name, image_url, status, response_headers, bool(headers)
+    )
+
+
+def existing_files(submission):
+    return [
+        file_name
+        for file_name in (submission["output_path"], submission["output_path_fb"])
+        if os.path.isfile(file_name)
+    ]
+
+
+def conditional_headers(view_id, file_name):
+    """Return If-None-Match/If-Modified-Since headers for a file we downloaded
+    before, empty if we don't know its validators or it changed locally"""
+    entry = get_entry(view_id)
+    if (
+        entry is None
+        or entry.get("path") != file_name
+        or entry.get("size") != os.path.getsize(file_name)
+    ):
+        return {}
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def check_verified_file(
+    view_id, file_name, image_url, status, headers, conditional=False
+):
+    """Act on the response to a verification request for file_name, return
+    False if the file was deleted"""
+    if status == 304:
+        return True
+    if status != 200:
+        print(
+            f'{config.ERROR_COLOR}Got a HTTP {status} while checking file size \
+"{image_url}" ...keeping file{config.END}'
+        )
+        return True
+    # a conditional request answered in full with other validators: the file
+    # changed on the server, even if its size didn't, and the new validators
+    # aren't those of our copy. Servers that ignore the conditions answer
+    # with the same ones and the size decides.
+    if conditional and validators_changed(view_id, headers):
+        print(
+            f"{config.WARN_COLOR}File changed on the server: \
+delete file {file_name}{config.END}"
+        )
+        os.remove(file_name)
+        forget_stored(view_id)
+        return False
+    # a compressed response's length says nothing about the file size
+    if not headers.get("Content-Encoding") and delete_file_if_mismatch_size(
+        file_name, headers.get("Content-Length", 0)
+    ):
+        forget_stored(view_id)
+        return False
+    record_file(view_id, file_name, image_url, headers)
+    return True
+
+
+def validators_changed(view_id, headers):
+    """Return True if a response doesn't carry the ETag/Last-Modified we
+    stored for view id's file"""
+    entry = get_entry(view_id) or {}
+    return any(
+        ours and headers.get(name) != ours
+        for name, ours in (
+            ("ETag", entry.get("etag")),
+            ("Last-Modified", entry.get("last_modified")),
+        )
+    )
+
+
+def record_file(view_id, file_name, url, headers):
+    """Remember a verified file and its validators for later conditional requests"""
+    update_entry(
+        view_id,
+        path=file_name,
+        size=os.path.getsize(file_name),
+        image_url=url,
+        etag=headers.get("ETag"),
+        last_modified=headers.get("Last-Modified"),
+    )
+
 
 def delete_file_if_mismatch_size(path, target_size):
     if type(target_size) != int:
@@ -199,7 +653,7 @@ def delete_file_if_mismatch_size(path, target_size):
         return True
     return False
 
-def create_metadata(output, data, s, title, filename):
+def create_metadata(output, data, title, filename):
     if config.rating is True:
         os.makedirs(f'{output}/{data.get("rating")}/metadata', exist_ok=True)
         metadata = f'{output}/{data.get("rating")}/metadata/{title} - {filename}'
@@ -207,62 +661,30 @@ def create_metadata(output, data, s, title, filename):
         os.makedirs(f"{output}/metadata", exist_ok=True)
         metadata = f"{output}/metadata/{title} - {filename}"
 
-    # Extract description as list
-    if config.json_description is True:
-        for desc in s.find("div", class_="submission-description").stripped_strings:
-            data["description"].append(desc)
-
-    # Extract tags
-
-    try:
-        for tag in s.find(class_="tags-row").findAll(class_="tags"):
-            data["tags"].append(tag.find("a").text)
-    except AttributeError:
-        print(f'{config.WARN_COLOR}"{title}" has no tags{config.END}')
-
-    # Extract comments
-    for comment in s.findAll(class_="comment_container"):
-        temp_ele = comment.find(class_="comment-parent")
-        parent_cid = None if temp_ele is None else int(temp_ele.attrs.get("href")[5:])
-        # Comment is deleted or hidden
-        if comment.find(class_="comment-link") is None:
-            continue
-
-        data["comments"].append(
-            {
-                "cid": int(comment.find(class_="comment-link").attrs.get("href")[5:]),
-                "parent_cid": parent_cid,
-                "content": comment.find(class_="user-submitted-links").text.strip(),
-                "username": comment.find(class_="comment_username").text,
-                "date": comment.find(class_="popup_date").attrs.get("title"),
-            }
-        )
-
     # Write a UTF-8 encoded JSON file for metadata
     with open(f"{metadata}.json", "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
+    return f"{metadata}.json"
 
 
-def file_exists_fallback(author, title, view_id):
+def file_exists_fallback(submission):
+    view_id = submission["view_id"]
     # do not write to index when check file size is enabled
     if not config.check_file_size:
-        with open(f"{config.output_folder}/index.idx", encoding="utf-8", mode="a+") as idx:
-            idx.write(f"({view_id})\n")
+        add_to_index(view_id)
+    # files from before the catalog existed, so next time the listing is enough
+    if get_entry(view_id) is None:
+        record_file(view_id, existing_files(submission)[0], submission["image_url"], {})
     if config.check is True:
         print(
             f'fallback: {config.SUCCESS_COLOR}Downloaded all recent files of \
-"{author}"{config.END}'
+"{submission["author"]}"{config.END}'
         )
         raise DownloadComplete
+    count("submissions_skipped")
+    event("skipped", title=submission["title"])
     print(
-        f'fallback: {config.WARN_COLOR}Skipping "{title}" since \
+        f'fallback: {config.WARN_COLOR}Skipping "{submission["title"]}" since \
 it\'s already downloaded{config.END}'
     )
     return True
-
-def get_image_cateory(s):
-    if s.find(class_ = 'button standard mobile-fix', string = 'Main Gallery') is not None:
-        return 'gallery'
-    elif s.find(class_='button standard mobile-fix', string = 'Scraps') is not None:
-        return 'scraps'
-    return 'unknown'
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""Leaving submissions out before they cost a request.
+
+Everything a gallery/scraps/favorites page tells about a submission (title,
+view id, and the rating and type from its figure's classes) is checked
+against --filter, --filter-title, --filter-rating, --filter-type and
+--min-id/--max-id before its view page is fetched. Listings have no dates,
+so --since/--until are checked on the view page, before the file download,
+as is the rating of submissions listed without one.
+"""
+
+import re
+from datetime import datetime
+
+import Modules.config as config
+from Modules.functions import check_filter
+from Modules.functions import compiled
+
+
+def listing_filter(item):
+    """Return why a listed submission is left out, None if it isn't"""
+    if config.submission_filter is True and check_filter(item.title) is True:
+        return "title"
+    if config.filter_title is not None and compiled(config.filter_title).search(
+        item.title
+    ):
+        return "title"
+    if (
+        config.filter_rating is not None
+        and item.rating is not None
+        and item.rating not in config.filter_rating
+    ):
+        return f"rating {item.rating}"
+    if (
+        config.filter_type is not None
+        and item.type is not None
+        and item.type not in config.filter_type
+    ):
+        return f"type {item.type}"
+    if item.view_id < config.min_id or (config.max_id and item.view_id > config.max_id):
+        return "view id"
+    return None
+
+
+def posted(record):
+    """Return the day a submission was posted, None if its date can't be read"""
+    if record.date is None:
+        return None
+    # "Jan 1, 2024 10:00 AM", or "Jan 1st, 2024 10:00 AM" with full dates on
+    date = re.sub(r"(\d+)(st|nd|rd|th)", r"\1", record.date)
+    try:
+        return datetime.strptime(date, "%b %d, %Y %I:%M %p").date()
+    except ValueError:
+        return None
+
+
+def view_filter(record):
+    """Return why a submission is left out by its view page, None if it isn't"""
+    rating = (record.rating or "").lower()
+    if (
+        config.filter_rating is not None
+        and rating
+        and rating not in config.filter_rating
+    ):
+        return f"rating {rating}"
+    if config.since is None and config.until is None:
+        return None
+    day = posted(record)
+    if day is None:
+        return None
+    if config.since is not None and day < config.since:
+        return f"posted {day}"
+    if config.until is not None and day > config.until:
+        return f"posted {day}"
+    return None
@@ -1,13 +1,26 @@
+import functools
 import http.cookiejar as cookielib
 import re
+import threading
 
 import browser_cookie3
 import requests
 from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
 from urllib3.util import Retry
 
 import Modules.config as config
+from Modules.metrics import count
+from Modules.metrics import event
+from Modules.metrics import host
+from Modules.metrics import observe
+from Modules.parser import parse_listing
+from Modules.ratelimit import RateLimitedAdapter
+
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_session_stats = {"sessions": 0, "requests": 0}
 
 
 def requests_retry_session(
@@ -16,10 +29,24 @@ def requests_retry_session(
     status_forcelist=(500, 502, 504, 104),
     session=None,
 ):
-    """Get a session, and retry in case of an error"""
-    session = session or requests.Session()
+    """Get the shared session (created once per process), and retry in case of
+    an error"""
+    global _session
+    if session is not None:
+        return _configure_session(session, retries, backoff_factor, status_forcelist)
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _configure_session(
+                    requests.Session(), retries, backoff_factor, status_forcelist
+                )
+    return _session
+
+
+def _configure_session(session, retries, backoff_factor, status_forcelist):
+    """Set headers, cookies and a pooled retrying adapter on the session"""
     if not config.request_compress:
-        session.headers.update({'Accept-Encoding': 'identity'})
+        session.headers.update({"Accept-Encoding": "identity"})
     if config.cookies is not None:  # add cookies if present
         cookies = cookielib.MozillaCookieJar(config.cookies)
         cookies.load()
@@ -32,57 +59,121 @@ def requests_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = RateLimitedAdapter(
+        max_retries=retry,
+        pool_connections=4,
+        # a connection per download thread and per listing page in flight
+        pool_maxsize=max(config.num_threads, 1)
+        + max(config.concurrent_crawls, 1) * max(config.prefetch_pages, 1),
+    )
     session.mount("http://", adapter)
     session.mount("https://", adapter)
+    session.hooks["response"].append(_count_request)
+    with _stats_lock:
+        _session_stats["sessions"] += 1
     return session
 
 
+def _count_request(response, *args, **kwargs):
+    with _stats_lock:
+        _session_stats["requests"] += 1
+    # time until the response headers arrived
+    count("http_responses", status=response.status_code, host=host(response.url))
+    observe(
+        "http_latency_seconds",
+        response.elapsed.total_seconds(),
+        host=host(response.url),
+    )
+
+
+def session_stats():
+    """Return request and connection pool counters of the shared session"""
+    stats = dict(_session_stats)
+    stats["connections"] = 0
+    if _session is not None:
+        adapter = _session.get_adapter(config.BASE_URL)
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                stats["connections"] += pool.num_connections
+    return stats
+
+
 class DownloadComplete(Exception):
     pass
 
 
+# kinds of DownloadError, only transient ones are worth retrying
+TRANSIENT = "transient"
+NOT_FOUND = "not found"
+LOGIN_REQUIRED = "login required"
+SYSTEM_MESSAGE = "system message"
+REJECTED = "rejected"
+
+
+class DownloadError(Exception):
+    """A download attempt failed, kind tells why"""
+
+    def __init__(self, message, kind=TRANSIENT):
+        super().__init__(message)
+        self.kind = kind
+
+    @property
+    def retryable(self):
+        return self.kind == TRANSIENT
+
+
+def classify_status(status):
+    """Return the DownloadError kind of an unexpected HTTP status"""
+    if status in (401, 403):
+        return LOGIN_REQUIRED
+    if status in (404, 410):
+        return NOT_FOUND
+    if status >= 500 or status in (408, 416, 429):
+        return TRANSIENT
+    return REJECTED
+
+
+def classify_system_message(message):
+    """Return the DownloadError kind of a furaffinity system message"""
+    message = message.lower()
+    if "not in our database" in message or "could not be found" in message:
+        return NOT_FOUND
+    if (
+        "log in" in message
+        or "registered users" in message
+        or "content filter" in message
+    ):
+        return LOGIN_REQUIRED
+    return SYSTEM_MESSAGE
+
+
+# set on Ctrl-C: crawlers stop, workers leave the rest of the queue in the
+# journal and running downloads keep their .part file
+interrupted = threading.Event()
+
+
+def crawl_key(download_url):
+    """Name a crawl by its listing, e.g. gallery/koul or msg/submissions"""
+    return download_url[len(config.BASE_URL) :].strip("/")
+
+
+@functools.lru_cache(maxsize=None)
+def compiled(pattern):
+    """Compile a case insensitive pattern once instead of on every search"""
+    return re.compile(pattern, re.IGNORECASE)
+
+
 def check_filter(title):
     """Compare post title and search string, then return 'True' if match found"""
 
-    match = re.search(
-        config.search,
-        title,
-        re.IGNORECASE,
-    )
+    match = compiled(config.search).search(title)
     if match is not None and title == match.string:
         return True
 
     return None
 
 
-def system_message_handler(s):
-    """Parse and return system message text"""
-    try:
-        message = {
-            s.find(class_="notice-message")
-            .find("div")
-            .find(class_="link-override")
-            .text.strip()
-        }
-    except AttributeError:
-        try:
-            message = (
-                s.find("section", class_="aligncenter notice-message")
-                .find("div", class_="section-body alignleft")
-                .find("div", class_="redirect-message")
-                .text.strip()
-            )
-        except AttributeError:
-            message = (
-                s.find("section", class_="aligncenter notice-message")
-                .find("div", class_="section-body alignleft")
-                .text.strip()
-            )
-    print(f"{config.WARN_COLOR}System Message: {message}{config.END}")
-    raise DownloadComplete
-
-
 def login():
     """Get cookies from any browser with logged in furaffinity and save them to file"""
     session = requests.Session()
@@ -118,32 +209,33 @@ furaffinity in your browser, or you can export cookies.txt manually{config.END}"
         )
 
 
-def next_button(page_url):
-    """Parse Next button and get next page url"""
+def fetch_page(page_url):
+    """Download and parse a gallery/submissions page exactly once, raise
+    DownloadError if the server didn't answer it"""
     response = requests_retry_session().get(page_url)
-    s = BeautifulSoup(response.text, "html.parser")
-    if config.submissions is True:
-        # unlike galleries that are sequentially numbered, submissions use a different scheme.
-        # the "page_num" is instead: new~[set of numbers]@(12 or 48 or 72) if sorting by new
-        parse_next_button = s.find("a", class_="button standard more")
-        if parse_next_button is None:
-                parse_next_button = s.find("a", class_="button standard more-half")
-        if parse_next_button is not None:
-            page_num = parse_next_button.attrs['href'].split("/")[-2]
-        else:
-            print(f"{config.WARN_COLOR}Unable to find next button{config.END}")
-            raise DownloadComplete
-    else:
-        parse_next_button = s.find("button", class_="button standard", text="Next")
-        if parse_next_button is None or parse_next_button.parent is None:
-            print(f"{config.WARN_COLOR}Unable to find next button{config.END}")
-            raise DownloadComplete
-        if config.category != "favorites":
-            page_num = parse_next_button.parent.attrs["action"].split("/")[-2]
-        else:
-            page_num = f"{parse_next_button.parent.attrs['action'].split('/')[-2]}/next"
+    check_status(page_url, response.status_code)
+    page = parse_listing(response.text)
+    crawled_page(page_url, response.status_code, page)
+    return page
+
+
+def check_status(url, status):
+    """Raise DownloadError for a page that wasn't answered with a 200. An
+    error page has no submissions and no Next button, a crawl must not take
+    it for the end of its listing."""
+    if status != 200:
+        raise DownloadError(f"Got a HTTP {status} for {url}", classify_status(status))
+
+
+def crawled_page(page_url, status, page):
+    count("pages_crawled")
+    event("page", url=page_url, status=status, submissions=len(page.submissions))
+
 
+def crawl_failed(download_url, error):
+    count("crawl_errors")
+    event("crawl_error", url=download_url, error=str(error))
     print(
-        f"Downloading page {page_num}"
+        f"{config.ERROR_COLOR}Crawling {download_url} failed, error {error}. \
+The next run continues where it stopped{config.END}"
     )
-    return page_num
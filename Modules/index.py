@@ -1,51 +1,223 @@
+import atexit
 import contextlib
+import os
 import re
-from functools import lru_cache
-from pathlib import Path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import Modules.config as config
+from Modules.cluster import file_lock
 
 
-@lru_cache(maxsize=None)
-def start_indexing(path, layer=0):
+VIEW_ID_PATTERN = re.compile(r"\((\d{5,})\)")
+# --store keeps another link to every file there, see Modules.store
+STORE = ".store"
+# unfinished downloads, see Modules.download.download_file
+PARTIAL_SUFFIXES = (".part", ".part.json")
 
-    """Recursively iterate over each item in path, then
-    save and print item's name.
+
+def start_indexing(path):
+    """Rebuild index.idx from the files in path.
+
+    Every author directory is scanned in parallel, then all found view ids are
+    written to index.idx in a single pass.
     """
+    started = time.monotonic()
+    view_ids = set()
+    files = 0
+    directories = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != STORE:
+                    directories.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                files += 1
+                if entry.name.endswith(PARTIAL_SUFFIXES):
+                    continue
+                match = VIEW_ID_PATTERN.search(entry.name)
+                if match:
+                    view_ids.add(int(match[1]))
 
-    # make Path object from input string
-    path = Path(path)
-    with open(f"{config.output_folder}/index.idx", encoding="utf-8", mode="a+") as idx:
+    with ThreadPoolExecutor(max(config.num_threads, 1)) as executor:
+        for found, count in executor.map(scan_directory, directories):
+            view_ids.update(found)
+            files += count
 
-        # iter the directory
-        for p in path.iterdir():
+    with open(f"{path}/index.idx.tmp", encoding="utf-8", mode="w") as idx:
+        idx.write("".join(f"({view_id})\n" for view_id in sorted(view_ids)))
+    os.replace(f"{path}/index.idx.tmp", f"{path}/index.idx")
 
-            if p.is_file():
-                name = p.stem
-                ext = p.suffix
-                match = re.search(r"\(\d{5,}\)", name)
-                if match is None and ext not in [".txt", ".idx"]:
-                    return
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(
+        f"indexed {len(view_ids)} submissions from {files} files in \
+{elapsed:.1f}s ({files / elapsed:.0f} files/s)"
+    )
+
+
+def scan_directory(path):
+    """Return view ids found in file names under path and the number of files"""
+    view_ids = set()
+    files = 0
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files += 1
+                    if entry.name.endswith(PARTIAL_SUFFIXES):
+                        continue
+                    match = VIEW_ID_PATTERN.search(entry.name)
+                    if match:
+                        view_ids.add(int(match[1]))
+    return view_ids, files
+
+
+_index = None
+_index_lock = threading.Lock()
+_index_duplicates = 0
+_writer = None
+# (view id, layout) queued for download in this run, so that a submission
+# listed by several concurrent crawls (gallery and favorites, ...) is only
+# fetched once, or once per layout with --store
+_claimed = set()
+
+
+class IndexWriter:
+    """Append view ids to index.idx from any thread.
+
+    Lines are buffered and written in batches, every batch is a single
+    write() of whole lines followed by an fsync, so a crash can lose at most
+    the last unsynced batch but never leaves interleaved or torn entries.
+    A timer flushes the buffer sync_interval seconds after its first entry
+    when no later write() does, e.g. during long downloads.
+    """
+
+    def __init__(self, path, sync_interval, batch_size=64):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.file = None
+        self.timer = None
+        self.last_sync = time.monotonic()
+
+    def write(self, view_id):
+        with self.lock:
+            self.buffer.append(f"({view_id})\n")
+            if (
+                len(self.buffer) >= self.batch_size
+                or time.monotonic() - self.last_sync >= self.sync_interval
+            ):
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.sync_interval, self._flush_later)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _flush_later(self):
+        with self.lock:
+            self.timer = None
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            if self.file is None:
+                self.file = open(self.path, encoding="utf-8", mode="a+")
+            with file_lock(self.path):
+                self.file.write("".join(self.buffer))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            self.buffer.clear()
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._flush()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load_index():
+    """Read index.idx once and keep its view ids in memory"""
+    global _index, _index_duplicates
+    if _index is not None:
+        return _index
+    with _index_lock:
+        if _index is None:
+            view_ids = set()
+            with contextlib.suppress(FileNotFoundError):
+                with open(f"{config.output_folder}/index.idx", encoding="utf-8") as idx:
+                    found = re.findall(r"\((\d+)\)", idx.read())
+                view_ids.update(map(int, found))
+                _index_duplicates = len(found) - len(view_ids)
+            _index = view_ids
+            atexit.register(close_index)
+    return _index
+
+
+def add_to_index(view_id):
+    """Remember view id and queue it for index.idx"""
+    global _writer
+    index = load_index()
+    with _index_lock:
+        if int(view_id) in index:
+            return
+        index.add(int(view_id))
+        if _writer is None:
+            _writer = IndexWriter(
+                f"{config.output_folder}/index.idx", config.index_sync_interval
+            )
+    _writer.write(view_id)
+
+
+def claim(view_id, layout=None):
+    """Return False if another crawl of this run already queued view id for
+    layout"""
+    key = (int(view_id), layout)
+    with _index_lock:
+        if key in _claimed:
+            return False
+        _claimed.add(key)
+    return True
+
+
+def close_index():
+    """Flush pending index entries and drop duplicate lines from index.idx"""
+    global _writer
+    with _index_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+    # other nodes may still be appending to the file that would be replaced
+    if _index_duplicates > 0 and config.node is None:
+        compact_index(f"{config.output_folder}/index.idx")
 
-                if match:
-                    idx.write(f"{match[0]}\n")
-                    print(f"found: {p}")
 
-            elif p.is_dir():
-                start_indexing(p, layer + 1)
-            else:
-                raise FileNotFoundError()
+def compact_index(path):
+    """Rewrite index file with each view id once, atomically"""
+    global _index_duplicates
+    with open(path, encoding="utf-8") as idx:
+        view_ids = dict.fromkeys(re.findall(r"\(\d+\)", idx.read()))
+    with open(f"{path}.tmp", encoding="utf-8", mode="w") as idx:
+        idx.write("".join(f"{view_id}\n" for view_id in view_ids))
+        idx.flush()
+        os.fsync(idx.fileno())
+    os.replace(f"{path}.tmp", path)
+    _index_duplicates = 0
 
 
-@lru_cache(maxsize=None)
 def check_file(path):
     """compare file view id with index list"""
     if config.check_file_size:
         return False
-    view_id = path.split("/")[-2:-1][0]
-    with contextlib.suppress(FileNotFoundError):
-        with open(f"{config.output_folder}/index.idx", encoding="utf-8") as idx:
-            index = idx.read()
-            match = re.search(rf"\({view_id}\)", index)
-        if match is not None:
-            return True
+    view_id = int(path.split("/")[-2:-1][0])
+    return view_id in load_index()
@@ -0,0 +1,140 @@
+"""Crash-safe record of the work of a run.
+
+journal.sqlite3 in the output folder holds every submission queued for
+download with its state (pending, in-progress, done, failed, unavailable)
+and how far each crawl got through its listing. A run that is interrupted or
+crashes leaves both behind, and the next run with the same crawls requeues the
+outstanding submissions and continues each listing where it stopped. A run
+that finishes clears everything but the failed submissions, which are retried
+next time. Unavailable ones (not found, login required, ...) are never
+requeued, retrying can't fix them.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+import Modules.config as config
+from Modules.cluster import node_file
+
+PENDING = "pending"
+IN_PROGRESS = "in-progress"
+DONE = "done"
+FAILED = "failed"
+UNAVAILABLE = "unavailable"
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def journal_path():
+    return node_file("journal.sqlite3")
+
+
+def load_journal():
+    """Open the journal once, jobs left in progress by a crash become pending"""
+    global _journal
+    if _journal is not None:
+        return _journal
+    with _journal_lock:
+        if _journal is None:
+            os.makedirs(config.output_folder, exist_ok=True)
+            journal = sqlite3.connect(
+                journal_path(), check_same_thread=False, isolation_level=None
+            )
+            # the journal belongs to one --node, so the WAL index is kept in
+            # its memory instead of a -shm file, which doesn't work on network
+            # filesystems
+            journal.execute("PRAGMA locking_mode=EXCLUSIVE")
+            journal.execute("PRAGMA journal_mode=WAL")
+            journal.execute("PRAGMA synchronous=NORMAL")
+            journal.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (path TEXT PRIMARY KEY, "
+                "category TEXT, crawl TEXT, state TEXT, attempts INTEGER, updated REAL)"
+            )
+            journal.execute(
+                "CREATE TABLE IF NOT EXISTS crawls (crawl TEXT PRIMARY KEY, "
+                "page TEXT, done INTEGER)"
+            )
+            journal.execute(
+                "UPDATE jobs SET state = ? WHERE state = ?", (PENDING, IN_PROGRESS)
+            )
+            _journal = journal
+            atexit.register(close_journal)
+    return _journal
+
+
+def _execute(query, parameters=()):
+    if config.dry_run:
+        return []
+    journal = load_journal()
+    with _journal_lock:
+        return journal.execute(query, parameters).fetchall()
+
+
+def add_job(path, category, crawl):
+    _execute(
+        "INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, 0, ?)",
+        (path, category, crawl, PENDING, time.time()),
+    )
+
+
+def set_state(path, state):
+    if state == IN_PROGRESS:
+        query = (
+            "UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? "
+            "WHERE path = ?"
+        )
+    else:
+        query = "UPDATE jobs SET state = ?, updated = ? WHERE path = ?"
+    _execute(query, (state, time.time(), path))
+
+
+def failure_state(error):
+    """State of a job whose DownloadError won't be retried in this run, only
+    transient failures carry over to the next one"""
+    return FAILED if error.retryable else UNAVAILABLE
+
+
+def outstanding_jobs(crawl):
+    """Return (path, category) of the crawl's submissions that aren't done
+    and can still be downloaded"""
+    return _execute(
+        "SELECT path, category FROM jobs WHERE crawl = ? AND state NOT IN (?, ?) "
+        "ORDER BY rowid",
+        (crawl, DONE, UNAVAILABLE),
+    )
+
+
+def crawl_progress(crawl):
+    """Return (page, done) of an unfinished crawl of a previous run, or None"""
+    rows = _execute("SELECT page, done FROM crawls WHERE crawl = ?", (crawl,))
+    if not rows:
+        return None
+    page, done = rows[0]
+    # a str like --start, --stop and the next_page tokens
+    return page, bool(done)
+
+
+def save_progress(crawl, page, done=False):
+    """Remember the next listing page of a crawl, or that it listed everything"""
+    _execute(
+        "INSERT OR REPLACE INTO crawls VALUES (?, ?, ?)", (crawl, str(page), int(done))
+    )
+
+
+def clear_journal(crawls):
+    """Forget the finished work of a run that wasn't interrupted"""
+    _execute("DELETE FROM jobs WHERE state IN (?, ?)", (DONE, UNAVAILABLE))
+    for crawl in crawls:
+        _execute("DELETE FROM crawls WHERE crawl = ?", (crawl,))
+
+
+def close_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is not None:
+            _journal.close()
+            _journal = None
@@ -0,0 +1,130 @@
+"""The listing side of a crawl, shared by both download engines.
+
+A crawl walks the pages of one listing (gallery/koul, favorites/koul,
+msg/submissions, ...) and picks the listed submissions to download, keeping
+its place in the journal and its --sync mark up to date on the way. Listing
+does all of that; the engines only fetch the pages it asks for and queue the
+submissions it hands out.
+"""
+
+import Modules.config as config
+from Modules.download import skip_submission
+from Modules.functions import crawl_key
+from Modules.functions import interrupted
+from Modules.journal import crawl_progress
+from Modules.journal import outstanding_jobs
+from Modules.journal import save_progress
+from Modules.manifest import progress_key
+from Modules.manifest import write_entry
+from Modules.store import claim_layout
+from Modules.sync import HighWaterMark
+from Modules.sync import reached_last_sync
+
+
+class Listing:
+    """One crawl of download_url, listing category for username"""
+
+    def __init__(self, username, category, download_url):
+        self.username = username
+        self.category = category
+        self.key = crawl_key(download_url)
+        self.progress = progress_key(download_url)
+        self.sync = HighWaterMark(download_url)
+        self.page_num = config.start
+        # no more pages to fetch
+        self.stopped = False
+        # stopped after listing everything new, the journal and --sync are
+        # only finished then
+        self.complete = False
+        # --sync and --check mostly stop on the first page, so pages are only
+        # fetched ahead once one was read without stopping
+        self.look_ahead = not config.check and self.sync.mark is None
+
+    def resume(self):
+        """Return the paths an interrupted run left to download, to be queued
+        again, and continue the listing where it stopped"""
+        outstanding = outstanding_jobs(self.key) if config.crawl_only is None else []
+        if outstanding:
+            print(f'Resuming {len(outstanding)} downloads of "{self.key}"')
+        paths = [
+            path
+            for path, _ in outstanding
+            if claim_layout(int(path.split("/")[-2]), self.category)
+        ]
+        progress = crawl_progress(self.progress)
+        if progress is None:
+            save_progress(self.progress, self.page_num)
+        else:
+            self.page_num, self.stopped = progress
+            if not self.stopped:
+                print(f"Continuing at page {self.page_num}")
+        return paths
+
+    def next_page(self, crawl_complete):
+        """Return the page to fetch next, None when the crawl is over.
+        crawl_complete is set by a worker when --check found a downloaded file."""
+        if self.stopped:
+            return None
+        if crawl_complete.is_set():
+            self.stop(complete=True)
+        elif config.stop == self.page_num:
+            print(
+                f'{config.WARN_COLOR}Reached page "{config.stop}", \
+stopping.{config.END}'
+            )
+            save_progress(self.progress, self.page_num, done=True)
+            self.stop()
+        elif self.sync.reached_page(self.page_num):
+            self.stop(complete=reached_last_sync(self.sync))
+        if self.stopped or interrupted.is_set():
+            return None
+        return self.page_num
+
+    def stop(self, complete=False):
+        self.stopped = True
+        self.complete = complete
+
+    def submissions(self, page):
+        """Yield the submissions of the fetched page that should be downloaded,
+        then move on to the page after it"""
+        # System messages
+        if page.system_message is not None:
+            print(
+                f"{config.WARN_COLOR}System Message: {page.system_message}{config.END}"
+            )
+            self.stop()
+            return
+
+        # End of gallery
+        if page.end_of_gallery:
+            print(f"{config.SUCCESS_COLOR}End of gallery{config.END}")
+            self.stop(complete=True)
+            return
+
+        for item in page.submissions:
+            if interrupted.is_set():
+                return
+            if self.sync.reached(item):
+                self.stop(complete=reached_last_sync(self.sync))
+                return
+            if skip_submission(item, self.username, category=self.category):
+                continue
+            if config.crawl_only is not None:
+                write_entry(item, self.category, self.key)
+                continue
+            yield item
+
+        if page.next_page is None:
+            print(f"{config.WARN_COLOR}Unable to find next button{config.END}")
+            self.stop(complete=True)
+            return
+        self.look_ahead = True
+        self.page_num = page.next_page
+        save_progress(self.progress, self.page_num)
+        print(f"Downloading page {self.page_num}")
+
+    def finish(self):
+        """Mark a complete crawl listed in the journal and save its --sync mark"""
+        if self.complete:
+            save_progress(self.progress, self.page_num, done=True)
+            self.sync.finish(self.page_num)
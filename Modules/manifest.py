@@ -0,0 +1,94 @@
+"""Manifests of crawled submissions.
+
+--crawl-only walks the listings like a normal run, with the same filters and
+index/catalog checks, but instead of fetching view pages and files it
+appends a JSON line per submission to a manifest: view id, path, title,
+author, rating and type from the listing, the crawl it came from and the
+image url if the catalog already knows it. --from-manifest downloads the
+submissions of such a manifest without crawling anything.
+"""
+
+import json
+import os
+import threading
+
+import Modules.config as config
+from Modules.catalog import get_entry
+from Modules.download import skip_submission
+from Modules.functions import crawl_key
+from Modules.parser import ListedSubmission
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def write_entry(item, category, crawl):
+    """Append a listed submission to the --crawl-only manifest"""
+    global _manifest
+    entry = get_entry(item.view_id) or {}
+    line = json.dumps(
+        {
+            "view_id": item.view_id,
+            "path": item.path,
+            "url": f"{config.BASE_URL}{item.path}",
+            "title": item.title,
+            "author": item.author,
+            "rating": item.rating,
+            "type": item.type,
+            "category": category,
+            "crawl": crawl,
+            "image_url": entry.get("image_url"),
+        },
+        ensure_ascii=False,
+    )
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = open(config.crawl_only, "a", encoding="utf-8")
+        _manifest.write(f"{line}\n")
+        _manifest.flush()
+
+
+def progress_key(download_url):
+    """Name a crawl's place in its listing in the journal, a --crawl-only run
+    keeps its own so that a normal run never continues where it stopped"""
+    if config.crawl_only is not None:
+        return f"crawl-only/{crawl_key(download_url)}"
+    return crawl_key(download_url)
+
+
+def manifest_key(manifest):
+    """Name the download of a manifest in the journal, like a crawl"""
+    return f"manifest/{os.path.basename(manifest)}"
+
+
+def read_manifest(manifest):
+    with open(manifest, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # e.g. the last line of a crawl that was killed while writing it
+                print(
+                    f"{config.WARN_COLOR}Skipping line {number} of {manifest}, \
+it isn't valid JSON{config.END}"
+                )
+
+
+def manifest_jobs(manifest):
+    """Yield (path, category) of the submissions of a manifest that still
+    need downloading, raise DownloadComplete like a crawl with --check"""
+    for entry in read_manifest(manifest):
+        item = ListedSubmission(
+            entry["view_id"],
+            entry["path"],
+            entry.get("title") or "",
+            entry.get("rating"),
+            entry.get("type"),
+            entry.get("author"),
+        )
+        category = entry.get("category") or config.category
+        if skip_submission(item, item.author, category):
+            continue
+        yield item.path, category
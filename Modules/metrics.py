@@ -0,0 +1,187 @@
+"""Counters and timings of a run.
+
+Everything is kept in memory and can be looked at three ways: a one line
+summary printed every --stats-interval seconds and at the end, a JSON-lines
+log of individual events (--event-log), and a Prometheus /metrics endpoint
+(--metrics-port).
+"""
+
+import bisect
+import json
+import threading
+import time
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import Modules.config as config
+
+PREFIX = "furaffinity_dl_"
+# seconds, for every histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}  # (name, labels) -> value
+_histograms: dict[tuple, list] = {}  # (name, labels) -> [bucket counts..., count, sum]
+_gauges: dict[str, Callable] = {}  # name -> function returning the current value
+_event_log = None
+_started = time.monotonic()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add value to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Record a duration in a histogram"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+
+def gauge(name, function):
+    """Report function() as the current value of name, e.g. the queue depth"""
+    with _lock:
+        _gauges[name] = function
+
+
+def host(url):
+    return urlparse(url).hostname or ""
+
+
+def event(kind, /, **fields):
+    """Append an event to --event-log"""
+    global _event_log
+    if config.event_log is None:
+        return
+    fields = {"time": round(time.time(), 3), "event": kind, **fields}
+    if config.node is not None:
+        fields["node"] = config.node
+    line = json.dumps(fields, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        if _event_log is None:
+            _event_log = open(config.event_log, "a", encoding="utf-8", buffering=1)
+        _event_log.write(line)
+
+
+def total(name, **labels):
+    """Sum of a counter over all label values matching labels"""
+    wanted = set(labels.items())
+    with _lock:
+        return sum(
+            value
+            for (counter, key), value in _counters.items()
+            if counter == name and wanted <= set(key)
+        )
+
+
+def summary():
+    elapsed = max(time.monotonic() - _started, 1e-9)
+    megabytes = total("bytes_downloaded") / 1024 / 1024
+    failed = total("crawl_errors")
+    line = (
+        f"{config.node + ' ' if config.node else ''}{elapsed:.0f}s: "
+        f"{total('pages_crawled')} pages, "
+        f"{total('submissions_seen')} submissions seen, "
+        f"{total('submissions_skipped')} skipped, "
+        f"{total('submissions_filtered')} filtered, "
+        f"{total('submissions_downloaded')} downloaded, "
+        f"{str(total('submissions_linked')) + ' linked, ' if config.store else ''}"
+        f"{megabytes:.1f} MB ({megabytes / elapsed:.2f} MB/s), "
+        f"{total('retries')} retries, {total('download_errors')} errors"
+        f"{f', {failed} failed crawls' if failed else ''}"
+    )
+    with _lock:
+        gauges = list(_gauges.items())
+    for name, function in gauges:
+        line += f", {name.replace('_', ' ')} {function()}"
+    return line
+
+
+def print_summary():
+    print(f"{config.SUCCESS_COLOR}{summary()}{config.END}")
+
+
+def start():
+    """Start the periodic summary and the Prometheus endpoint if enabled"""
+    if config.stats_interval > 0:
+        threading.Thread(target=_report, daemon=True).start()
+    if config.metrics_port:
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", config.metrics_port), _MetricsHandler
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://127.0.0.1:{config.metrics_port}/metrics")
+
+
+def _report():
+    while True:
+        time.sleep(config.stats_interval)
+        print_summary()
+
+
+def _labels(key, extra=()):
+    labels = [*key, *extra]
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def exposition():
+    """Render everything in the Prometheus text format"""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+        gauges = sorted(_gauges.items())
+    seen = set()
+    for (name, key), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+        lines.append(f"{PREFIX}{name}_total{_labels(key)} {value}")
+    for (name, key), histogram in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+        cumulative = 0
+        for bound, bucket in zip((*BUCKETS, "+Inf"), histogram):
+            cumulative += bucket
+            lines.append(
+                f"{PREFIX}{name}_bucket{_labels(key, [('le', bound)])} {cumulative}"
+            )
+        lines.append(f"{PREFIX}{name}_count{_labels(key)} {histogram[-2]}")
+        lines.append(f"{PREFIX}{name}_sum{_labels(key)} {histogram[-1]}")
+    for name, function in gauges:
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        lines.append(f"{PREFIX}{name} {function()}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,384 @@
+"""Parsing of furaffinity listing and view pages.
+
+The backend is picked with --parser: BeautifulSoup with the stdlib
+"html.parser" or the faster "lxml" tree builder, or "selectolax" (lexbor)
+which is several times faster again. Each page is parsed once into a typed
+record so the rest of the program never walks the HTML tree itself.
+"""
+
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Optional
+
+from bs4 import BeautifulSoup
+
+import Modules.config as config
+from Modules.metrics import observe
+
+
+@dataclass
+class ListedSubmission:
+    """A submission as shown on a gallery/scraps/favorites/submissions page"""
+
+    view_id: int
+    path: str  # /view/<id>/
+    title: str
+    rating: Optional[str] = None  # general/mature/adult, from the figure's r-* class
+    type: Optional[str] = None  # image/text/audio/flash..., from the figure's t-* class
+    author: Optional[str] = None  # lowercased username, from the figure's u-* class
+
+
+@dataclass
+class ListingPage:
+    """Everything main() needs from one gallery/submissions page"""
+
+    submissions: list = field(default_factory=list)  # ListedSubmission
+    next_page: Optional[str] = None
+    system_message: Optional[str] = None
+    end_of_gallery: bool = False
+
+
+@dataclass
+class Submission:
+    """Everything download() needs from one view page"""
+
+    view_id: int
+    image: Optional[str] = None  # href of the download button
+    author: Optional[str] = None
+    title: Optional[str] = None
+    rating: Optional[str] = None
+    real_category: str = "unknown"
+    system_message: Optional[str] = None
+    date: Optional[str] = None
+    # only filled in with --metadata
+    description: Optional[str] = None
+    description_html: Optional[str] = None
+    description_strings: list = field(default_factory=list)
+    category: Optional[str] = None
+    type: Optional[str] = None
+    species: Optional[str] = None
+    gender: Optional[str] = None
+    views: Optional[int] = None
+    favorites: Optional[int] = None
+    tags: Optional[list] = None  # None when the submission has no tags row
+    comments: list = field(default_factory=list)
+
+
+def parse_listing(html):
+    """Parse a gallery/submissions page into a ListingPage"""
+    started = time.perf_counter()
+    if config.parser_backend == "selectolax":
+        page = _selectolax_listing(html)
+    else:
+        page = _soup_listing(BeautifulSoup(html, config.parser_backend))
+    observe("parse_seconds", time.perf_counter() - started, page="listing")
+    return page
+
+
+def parse_submission(html, path):
+    """Parse a view page into a Submission, raise AttributeError if it isn't one"""
+    started = time.perf_counter()
+    view_id = int(path.split("/")[-2:-1][0])
+    if config.parser_backend == "selectolax":
+        submission = _selectolax_submission(html, view_id)
+    else:
+        submission = _soup_submission(
+            BeautifulSoup(html, config.parser_backend), view_id
+        )
+    observe("parse_seconds", time.perf_counter() - started, page="view")
+    return submission
+
+
+def listed_submission(view_path, title, classes, figure_id=None):
+    """Build a ListedSubmission from a figure's link, title and class names"""
+    if figure_id is not None and figure_id.startswith("sid-"):
+        view_id = int(figure_id[4:])
+    else:
+        view_id = int(view_path.split("/")[-2:-1][0])
+    item = ListedSubmission(view_id, view_path, title)
+    for name in classes:
+        if name.startswith("r-"):
+            item.rating = name[2:]
+        elif name.startswith("t-"):
+            item.type = name[2:]
+        elif name.startswith("u-"):
+            item.author = name[2:]
+    return item
+
+
+def _soup_listing(s):
+    page = ListingPage()
+
+    # System messages
+    if s.find(class_="notice-message") is not None:
+        page.system_message = _soup_system_message(s)
+        return page
+
+    # End of gallery
+    if s.find(id="no-images") is not None:
+        page.end_of_gallery = True
+        return page
+
+    for img in s.findAll("figure"):
+        page.submissions.append(
+            listed_submission(
+                img.find("a").attrs.get("href"),
+                img.find("figcaption").contents[0].text,
+                img.attrs.get("class", []),
+                img.attrs.get("id"),
+            )
+        )
+
+    if config.submissions is True:
+        # unlike galleries that are sequentially numbered, submissions use a
+        # different scheme. the "page_num" is instead:
+        # new~[set of numbers]@(12 or 48 or 72) if sorting by new
+        parse_next_button = s.find("a", class_="button standard more")
+        if parse_next_button is None:
+            parse_next_button = s.find("a", class_="button standard more-half")
+        if parse_next_button is not None:
+            page.next_page = next_page_token(href=parse_next_button.attrs["href"])
+    else:
+        parse_next_button = s.find("button", class_="button standard", string="Next")
+        if parse_next_button is not None and parse_next_button.parent is not None:
+            page.next_page = next_page_token(
+                action=parse_next_button.parent.attrs["action"]
+            )
+    return page
+
+
+def _soup_system_message(s):
+    try:
+        return (
+            s.find(class_="notice-message")
+            .find("div")
+            .find(class_="link-override")
+            .text.strip()
+        )
+    except AttributeError:
+        try:
+            return (
+                s.find("section", class_="aligncenter notice-message")
+                .find("div", class_="section-body alignleft")
+                .find("div", class_="redirect-message")
+                .text.strip()
+            )
+        except AttributeError:
+            return (
+                s.find("section", class_="aligncenter notice-message")
+                .find("div", class_="section-body alignleft")
+                .text.strip()
+            )
+
+
+def _soup_submission(s, view_id):
+    submission = Submission(view_id)
+
+    # System messages
+    if s.find(class_="notice-message") is not None:
+        submission.system_message = _soup_system_message(s)
+        return submission
+
+    submission.image = s.find(class_="download").find("a").attrs.get("href")
+    submission.author = (
+        s.find(class_="submission-id-sub-container").find("a").find("strong").text
+    )
+    submission.title = str(s.find(class_="submission-title").find("p").contents[0])
+    submission.rating = s.find(class_="rating-box").text.strip()
+    if s.find(class_="button standard mobile-fix", string="Main Gallery") is not None:
+        submission.real_category = "gallery"
+    elif s.find(class_="button standard mobile-fix", string="Scraps") is not None:
+        submission.real_category = "scraps"
+    submission.date = s.find(class_="popup_date").attrs.get("title")
+
+    if not config.metadata:
+        return submission
+
+    description = s.find(class_="submission-description")
+    submission.description = description.text.strip().replace("\r\n", "\n")
+    if config.html_description is True:
+        submission.description_html = description.prettify()
+    if config.json_description is True:
+        submission.description_strings = list(description.stripped_strings)
+    info = s.find(class_="info")
+    submission.category = info.find(class_="category-name").text
+    submission.type = info.find(class_="type-name").text
+    submission.species = info.findAll("div")[2].find("span").text
+    submission.gender = info.findAll("div")[3].find("span").text
+    submission.views = int(s.find(class_="views").find(class_="font-large").text)
+    submission.favorites = int(
+        s.find(class_="favorites").find(class_="font-large").text
+    )
+
+    tags_row = s.find(class_="tags-row")
+    if tags_row is not None:
+        submission.tags = [
+            tag.find("a").text for tag in tags_row.findAll(class_="tags")
+        ]
+
+    for comment in s.findAll(class_="comment_container"):
+        temp_ele = comment.find(class_="comment-parent")
+        parent_cid = None if temp_ele is None else int(temp_ele.attrs.get("href")[5:])
+        # Comment is deleted or hidden
+        if comment.find(class_="comment-link") is None:
+            continue
+
+        submission.comments.append(
+            {
+                "cid": int(comment.find(class_="comment-link").attrs.get("href")[5:]),
+                "parent_cid": parent_cid,
+                "content": comment.find(class_="user-submitted-links").text.strip(),
+                "username": comment.find(class_="comment_username").text,
+                "date": comment.find(class_="popup_date").attrs.get("title"),
+            }
+        )
+    return submission
+
+
+def next_page_token(href=None, action=None):
+    """Turn the Next button's link into the page_num main() appends to the url"""
+    if href is not None:
+        return href.split("/")[-2]
+    # favorites are paged by a cursor: /favorites/<user>/<fave id>/next
+    if not action.rstrip("/").endswith("/next"):
+        return action.split("/")[-2]
+    return f"{action.rstrip('/').split('/')[-2]}/next"
+
+
+def _selectolax_tree(html):
+    # imported here so selectolax is only needed when it is selected
+    from selectolax.lexbor import LexborHTMLParser
+
+    return LexborHTMLParser(html)
+
+
+def _first(node, selector):
+    """css_first that raises AttributeError like a failed bs4 find chain"""
+    found = node.css_first(selector) if node is not None else None
+    if found is None:
+        raise AttributeError(selector)
+    return found
+
+
+def _selectolax_listing(html):
+    tree = _selectolax_tree(html)
+    page = ListingPage()
+
+    if tree.css_first(".notice-message") is not None:
+        page.system_message = _selectolax_system_message(tree)
+        return page
+
+    if tree.css_first("#no-images") is not None:
+        page.end_of_gallery = True
+        return page
+
+    for img in tree.css("figure"):
+        caption = _first(img, "figcaption")
+        title = caption.child
+        while title is not None and title.tag == "-text" and not title.text().strip():
+            title = title.next
+        page.submissions.append(
+            listed_submission(
+                _first(img, "a").attributes.get("href"),
+                title.text() if title is not None else "",
+                (img.attributes.get("class") or "").split(),
+                img.attributes.get("id"),
+            )
+        )
+
+    if config.submissions is True:
+        parse_next_button = tree.css_first("a.button.standard.more") or tree.css_first(
+            "a.button.standard.more-half"
+        )
+        if parse_next_button is not None:
+            page.next_page = next_page_token(href=parse_next_button.attributes["href"])
+    else:
+        for button in tree.css("button.button.standard"):
+            if button.text() == "Next" and button.parent is not None:
+                page.next_page = next_page_token(
+                    action=button.parent.attributes["action"]
+                )
+                break
+    return page
+
+
+def _selectolax_system_message(tree):
+    for selector in (
+        ".notice-message div .link-override",
+        "section.aligncenter.notice-message div.section-body.alignleft "
+        "div.redirect-message",
+        "section.aligncenter.notice-message div.section-body.alignleft",
+    ):
+        node = tree.css_first(selector)
+        if node is not None:
+            return node.text().strip()
+    return ""
+
+
+def _selectolax_submission(html, view_id):
+    tree = _selectolax_tree(html)
+    submission = Submission(view_id)
+
+    if tree.css_first(".notice-message") is not None:
+        submission.system_message = _selectolax_system_message(tree)
+        return submission
+
+    submission.image = _first(tree, ".download a").attributes.get("href")
+    submission.author = _first(tree, ".submission-id-sub-container a strong").text()
+    title = _first(tree, ".submission-title p").child
+    submission.title = title.text() if title is not None else ""
+    submission.rating = _first(tree, ".rating-box").text().strip()
+    for button in tree.css(".button.standard.mobile-fix"):
+        if button.text() == "Main Gallery":
+            submission.real_category = "gallery"
+            break
+        if button.text() == "Scraps":
+            submission.real_category = "scraps"
+            break
+    submission.date = _first(tree, ".popup_date").attributes.get("title")
+
+    if not config.metadata:
+        return submission
+
+    description = _first(tree, ".submission-description")
+    submission.description = description.text().strip().replace("\r\n", "\n")
+    if config.html_description is True:
+        submission.description_html = description.html
+    if config.json_description is True:
+        submission.description_strings = [
+            string
+            for string in description.text(separator="\0", strip=True).split("\0")
+            if string
+        ]
+    info = _first(tree, ".info")
+    submission.category = _first(info, ".category-name").text()
+    submission.type = _first(info, ".type-name").text()
+    info_divs = info.css("div")
+    submission.species = _first(info_divs[2], "span").text()
+    submission.gender = _first(info_divs[3], "span").text()
+    submission.views = int(_first(tree, ".views .font-large").text())
+    submission.favorites = int(_first(tree, ".favorites .font-large").text())
+
+    tags_row = tree.css_first(".tags-row")
+    if tags_row is not None:
+        submission.tags = [_first(tag, "a").text() for tag in tags_row.css(".tags")]
+
+    for comment in tree.css(".comment_container"):
+        parent = comment.css_first(".comment-parent")
+        parent_cid = None if parent is None else int(parent.attributes.get("href")[5:])
+        link = comment.css_first(".comment-link")
+        # Comment is deleted or hidden
+        if link is None:
+            continue
+
+        submission.comments.append(
+            {
+                "cid": int(link.attributes.get("href")[5:]),
+                "parent_cid": parent_cid,
+                "content": _first(comment, ".user-submitted-links").text().strip(),
+                "username": _first(comment, ".comment_username").text(),
+                "date": _first(comment, ".popup_date").attributes.get("title"),
+            }
+        )
+    return submission
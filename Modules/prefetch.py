@@ -0,0 +1,73 @@
+"""Fetching numbered listing pages ahead of the crawl.
+
+Galleries, scraps and their folders are paged by number, so while one page
+is being read the next --prefetch-pages - 1 can already be on their way
+instead of costing a round trip each once the crawl gets there. With --sync
+or --check that only starts once a page didn't stop the crawl. Favorites
+and submissions are paged by a cursor found on the previous page and are
+fetched one at a time.
+"""
+
+from functools import partial
+
+import Modules.config as config
+from Modules.functions import crawl_key
+
+NUMBERED = ("gallery", "scraps")
+
+
+class PagePrefetcher:
+    """Hands out the listing pages of download_url as futures, start(page_url)
+    starts fetching one and returns its future (or asyncio task)"""
+
+    def __init__(self, download_url, start):
+        self.download_url = download_url
+        self.start = start
+        self.numbered = (
+            config.prefetch_pages > 1
+            and crawl_key(download_url).split("/")[0] in NUMBERED
+        )
+        self.pending = {}
+        # first page known to be the last one, nothing after it is fetched
+        self.end = None
+
+    def fetch(self, page_num, ahead=True):
+        """Return the future of page_num and, with ahead, start the pages
+        after it"""
+        if not self.numbered or not str(page_num).isdigit():
+            return self.start(f"{self.download_url}/{page_num}")
+        number = int(page_num)
+        for skipped in [n for n in self.pending if n < number]:
+            self.pending.pop(skipped).cancel()
+        last = number + (config.prefetch_pages if ahead else 1)
+        if self.end is not None:
+            last = min(last, self.end + 1)
+        if str(config.stop).isdigit() and int(config.stop) > number:
+            last = min(last, int(config.stop))
+        for ahead in range(number, last):
+            if ahead not in self.pending:
+                future = self.start(f"{self.download_url}/{ahead}")
+                future.add_done_callback(partial(self.fetched, ahead))
+                self.pending[ahead] = future
+        future = self.pending.pop(number, None)
+        if future is None:
+            future = self.start(f"{self.download_url}/{page_num}")
+        return future
+
+    def fetched(self, number, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        page = future.result()
+        if (
+            page.end_of_gallery
+            or page.system_message is not None
+            or page.next_page is None
+        ):
+            if self.end is None or number < self.end:
+                self.end = number
+
+    def close(self):
+        """Cancel the pages fetched ahead that weren't needed"""
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
@@ -0,0 +1,114 @@
+"""Progress of the file downloads.
+
+--progress bars draws a tqdm bar per file. aggregate draws a single bar for
+the whole run (bytes, throughput, files/s and active transfers), redrawn
+twice a second from the byte counts of the running transfers, so a chunk
+only adds to its own transfer. quiet draws nothing at all.
+"""
+
+import threading
+import time
+
+from tqdm import tqdm
+
+import Modules.config as config
+
+REFRESH = 0.5
+
+_lock = threading.Lock()
+_active = set()
+_finished_bytes = 0
+_files = 0
+_started = None
+_bar = None
+_display = None
+_stop = threading.Event()
+
+
+def transfer(desc, total, initial=0):
+    """Return the progress of one file download, a context manager with
+    update(bytes)"""
+    if config.progress == "bars":
+        return tqdm(
+            desc=desc.ljust(40),
+            total=total,
+            initial=initial,
+            miniters=100,
+            unit="b",
+            unit_scale=True,
+            unit_divisor=1024,
+        )
+    if config.progress == "aggregate":
+        return _Transfer()
+    return _QUIET
+
+
+class _Quiet:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def update(self, size):
+        pass
+
+
+_QUIET = _Quiet()
+
+
+class _Transfer:
+    def __init__(self):
+        self.done = 0
+
+    def __enter__(self):
+        global _display, _started
+        with _lock:
+            _active.add(self)
+            if _display is None:
+                _started = time.monotonic()
+                _display = threading.Thread(target=_redraw, daemon=True)
+                _display.start()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        global _finished_bytes, _files
+        with _lock:
+            _active.discard(self)
+            _finished_bytes += self.done
+            if exc_type is None:
+                _files += 1
+        return False
+
+    def update(self, size):
+        self.done += size
+
+
+def _redraw():
+    global _bar
+    _bar = tqdm(
+        desc="Downloading".ljust(40), unit="b", unit_scale=True, unit_divisor=1024
+    )
+    shown = 0
+    while True:
+        stopping = _stop.wait(REFRESH)
+        with _lock:
+            done = _finished_bytes + sum(t.done for t in _active)
+            active = len(_active)
+            files = _files
+        elapsed = max(time.monotonic() - _started, 1e-9)
+        _bar.set_postfix(
+            files=files, files_s=f"{files / elapsed:.2f}", active=active, refresh=False
+        )
+        _bar.update(done - shown)
+        shown = done
+        if stopping:
+            _bar.close()
+            return
+
+
+def close():
+    """Draw the final state of the aggregate bar"""
+    if _display is not None:
+        _stop.set()
+        _display.join()
@@ -0,0 +1,144 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+import Modules.config as config
+
+# statuses that mean "slow down" rather than "broken"
+THROTTLE_STATUSES = (429, 503)
+MAX_PENALTY = 30
+
+
+class RateLimiter:
+    """Token bucket plus connection cap shared by every thread for one host group.
+
+    `rate` is requests per second (0 = unlimited). Throttling responses add a
+    penalty to the interval between requests which halves on its way back to
+    zero as requests succeed again.
+    """
+
+    def __init__(self, rate, max_connections):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.penalty = 0
+        self.next_request = time.monotonic()
+        self.lock = threading.Lock()
+        self.connections = (
+            threading.BoundedSemaphore(max_connections) if max_connections > 0 else None
+        )
+
+    def acquire(self):
+        if self.connections is not None:
+            self.connections.acquire()
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self):
+        """Take the next request slot and return how long to wait for it"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_request)
+            self.next_request = start + self.interval + self.penalty
+        return start - now
+
+    def release(self):
+        if self.connections is not None:
+            self.connections.release()
+
+    def throttled(self, retry_after):
+        """Back off after a 429/503, honouring Retry-After when the server sent one"""
+        with self.lock:
+            self.penalty = min(max(self.penalty * 2, 0.5), MAX_PENALTY)
+            self.next_request = max(
+                self.next_request, time.monotonic() + max(retry_after, self.penalty)
+            )
+
+    def succeeded(self):
+        if self.penalty:
+            with self.lock:
+                self.penalty = self.penalty / 2 if self.penalty > 0.05 else 0
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url):
+    """Pages on the main site and media on any other host are limited separately"""
+    group = (
+        "pages"
+        if urlparse(url).hostname == urlparse(config.BASE_URL).hostname
+        else "media"
+    )
+    with _limiters_lock:
+        if group not in _limiters:
+            rate = config.rate_limit if group == "pages" else config.media_rate_limit
+            _limiters[group] = RateLimiter(rate, config.max_connections)
+        return _limiters[group]
+
+
+def parse_retry_after(value):
+    """Return Retry-After header (seconds or HTTP date) as seconds to wait"""
+    if not value:
+        return 0
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter that sends every request through the host group's limiter"""
+
+    def __init__(self, *args, throttle_retries=5, **kwargs):
+        self.throttle_retries = throttle_retries
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        limiter = get_limiter(request.url)
+        for attempt in range(self.throttle_retries + 1):
+            limiter.acquire()
+            try:
+                response = super().send(request, stream=stream, **kwargs)
+            except BaseException:
+                limiter.release()
+                raise
+            if (
+                response.status_code not in THROTTLE_STATUSES
+                or attempt == self.throttle_retries
+            ):
+                break
+            limiter.throttled(parse_retry_after(response.headers.get("Retry-After")))
+            print(
+                f"{config.WARN_COLOR}Got a HTTP {response.status_code} for \
+{request.url}, slowing down{config.END}"
+            )
+            response.close()
+            limiter.release()
+
+        if response.status_code not in THROTTLE_STATUSES:
+            limiter.succeeded()
+        if not stream:
+            limiter.release()
+        else:
+            # streamed bodies keep the connection busy until the response is closed
+            close = response.close
+            released = threading.Event()
+
+            def close_and_release():
+                try:
+                    close()
+                finally:
+                    if not released.is_set():
+                        released.set()
+                        limiter.release()
+
+            response.close = close_and_release
+        return response
@@ -0,0 +1,109 @@
+"""Retrying failed downloads later instead of straight away.
+
+A transient failure puts the submission back in the download queue after an
+exponentially growing, jittered delay, so a struggling server isn't hammered
+and the worker is free for other submissions in the meantime. Missing
+submissions, login walls and other system messages are not retried.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import Modules.config as config
+from Modules.metrics import count
+from Modules.metrics import event
+
+MAX_BACKOFF = 300
+
+
+def backoff(attempt):
+    """Return the delay before retry number attempt + 1: --retry-backoff
+    doubled for every earlier attempt, half of it random so that submissions
+    failing together don't come back together"""
+    delay = min(config.retry_backoff * 2**attempt, MAX_BACKOFF)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_delay(error, path, attempt):
+    """Report a failed attempt, return how long to wait before the next one or
+    None when the submission should be given up"""
+    count("download_errors", kind=error.kind)
+    if not error.retryable or attempt >= config.retries:
+        event("error", path=path, kind=error.kind, error=str(error), attempt=attempt)
+        print(
+            f"{config.ERROR_COLOR}{error}, giving up on {config.BASE_URL}{path} \
+({error.kind}){config.END}"
+        )
+        return None
+    delay = backoff(attempt)
+    count("retries")
+    event(
+        "retry",
+        path=path,
+        kind=error.kind,
+        error=str(error),
+        attempt=attempt + 1,
+        delay=round(delay, 3),
+    )
+    print(
+        f"{config.WARN_COLOR}{error}, retrying {attempt + 1}/{config.retries} \
+in {delay:.1f}s{config.END}"
+    )
+    return delay
+
+
+class RetryScheduler:
+    """Holds failed jobs until their delay passed, then hands them to submit"""
+
+    def __init__(self, submit):
+        self.submit = submit
+        self.jobs = []
+        self.order = itertools.count()  # never compare the jobs themselves
+        self.submitting = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, delay, job):
+        with self.condition:
+            heapq.heappush(self.jobs, (time.monotonic() + delay, next(self.order), job))
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (
+                    not self.jobs or self.jobs[0][0] > time.monotonic()
+                ):
+                    timeout = self.jobs[0][0] - time.monotonic() if self.jobs else None
+                    self.condition.wait(timeout)
+                if self.closed:
+                    return
+                _, _, job = heapq.heappop(self.jobs)
+                self.submitting += 1
+            # outside of the lock, submit may block on a full queue
+            self.submit(job)
+            with self.condition:
+                self.submitting -= 1
+                self.condition.notify_all()
+
+    def wait(self):
+        """Block until every scheduled job was submitted, return False if
+        there were none"""
+        with self.condition:
+            if not self.jobs and not self.submitting:
+                return False
+            while (self.jobs or self.submitting) and not self.closed:
+                self.condition.wait()
+        return True
+
+    def close(self):
+        """Drop the remaining jobs and stop"""
+        with self.condition:
+            self.closed = True
+            self.jobs.clear()
+            self.condition.notify_all()
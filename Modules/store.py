@@ -0,0 +1,286 @@
+"""One copy of every downloaded file, linked into each layout that wants it.
+
+The same submission can belong in several trees of the output folder: the
+author's gallery, scraps or folders and the favorites of whoever faved it.
+With --store every downloaded file is also kept in OUTPUT/.store under its
+view id and SHA-256, and the catalog remembers which layouts (gallery,
+scraps, favorites, folders/X, ...) have it. When another layout lists the
+submission its file is hardlinked from the store instead of downloaded
+again, or copied where hardlinks aren't supported (FAT, another device).
+
+Hardlinked files are one file: editing one in place edits every layout.
+The downloader never does, it replaces files instead.
+
+--dedupe collapses the duplicates of an existing output folder the same way,
+offline and in parallel.
+"""
+
+import contextlib
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import Modules.config as config
+from Modules.catalog import get_entry
+from Modules.catalog import update_entry
+from Modules.index import claim
+from Modules.index import PARTIAL_SUFFIXES
+from Modules.index import STORE
+from Modules.index import VIEW_ID_PATTERN
+from Modules.metrics import count
+
+
+# view id -> [lock, jobs holding or waiting for it], see store_lock
+_store_locks: dict[int, list[Any]] = {}
+_store_locks_lock = threading.Lock()
+
+
+def store_folder():
+    return f"{config.output_folder}/{STORE}"
+
+
+def layout(category):
+    """Name the tree of the output folder a crawl of category writes to"""
+    if config.real_category:
+        return "real-category"
+    if config.folder is not None:
+        return f"folders/{config.folder.split('/')[1]}"
+    return category or config.category
+
+
+def digest(path):
+    """SHA-256 of a file, as hex"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def store_path(view_id, sha, extension):
+    name = f"{view_id}-{sha}" if view_id is not None else sha
+    return f"{store_folder()}/{sha[:2]}/{name}{extension}"
+
+
+def link(source, target, copy=True):
+    """Replace target by a hardlink to source, or a copy of it when hardlinks
+    fail and copy is True. Return False if nothing was done."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f"{target}.link"
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temporary)
+    try:
+        os.link(source, temporary)
+    except OSError:
+        if not copy:
+            return False
+        shutil.copyfile(source, temporary)
+    os.replace(temporary, target)
+    return True
+
+
+def claim_layout(view_id, category):
+    """claim() view id once per run, or once per layout with --store so that
+    every layout listing it gets a job that links it"""
+    return claim(view_id, layout(category) if config.store else None)
+
+
+def hold_store_lock(view_id, new_lock):
+    """Return view id's store lock, made with new_lock for its first job, and
+    count the job in until release_store_lock"""
+    with _store_locks_lock:
+        entry = _store_locks.setdefault(int(view_id), [new_lock(), 0])
+        entry[1] += 1
+    return entry[0]
+
+
+def release_store_lock(view_id):
+    with _store_locks_lock:
+        entry = _store_locks[int(view_id)]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _store_locks[int(view_id)]
+
+
+@contextlib.contextmanager
+def store_lock(view_id):
+    """Hold view id's lock while linking it from the store or downloading it
+    into it with --store, so that of the layouts listing it at the same time
+    one downloads it and the others wait to link it"""
+    if not config.store:
+        yield
+        return
+    lock = hold_store_lock(view_id, threading.Lock)
+    try:
+        with lock:
+            yield
+    finally:
+        release_store_lock(view_id)
+
+
+def being_stored(view_id):
+    with _store_locks_lock:
+        return int(view_id) in _store_locks
+
+
+def stored_elsewhere(view_id, category):
+    """Return True if view id is in the store, or another layout is storing it
+    right now, but not yet linked into the layout category crawls to, so that
+    it is linked instead of skipped"""
+    if being_stored(view_id):
+        return True
+    entry = get_entry(view_id)
+    return (
+        entry is not None
+        and "layouts" in entry
+        and layout(category) not in entry["layouts"]
+        and os.path.isfile(entry.get("store") or "")
+    )
+
+
+def link_stored(submission, category):
+    """Link a stored file of the submission into its output path, return
+    False if it has to be downloaded"""
+    if not config.store:
+        return False
+    view_id = submission["view_id"]
+    entry = get_entry(view_id)
+    if entry is None or not os.path.isfile(entry.get("store") or ""):
+        return False
+    # the store copy shares its inode with every layout, a file changed in
+    # place in any of them changed it too
+    size = entry.get("size")
+    if (size is not None and os.path.getsize(entry["store"]) != size) or digest(
+        entry["store"]
+    ) != entry.get("sha"):
+        print(
+            f'{config.WARN_COLOR}The stored copy of "{submission["title"]}" \
+changed, downloading it again{config.END}'
+        )
+        forget_stored(view_id)
+        return False
+    link(entry["store"], submission["output_path"])
+    add_layout(view_id, entry, category)
+    count("submissions_linked")
+    print(
+        f'{config.SUCCESS_COLOR}Linked "{submission["title"]}" from the store\
+{config.END}'
+    )
+    return True
+
+
+def store_file(view_id, file_name, category):
+    """Keep a downloaded file in the store, or link it to the stored copy
+    when that has the same content"""
+    if not config.store:
+        return
+    sha = digest(file_name)
+    stored = store_path(view_id, sha, os.path.splitext(file_name)[1])
+    if os.path.isfile(stored):
+        link(stored, file_name)
+    else:
+        link(file_name, stored)
+    add_layout(view_id, get_entry(view_id) or {}, category, sha=sha, store=stored)
+
+
+def forget_stored(view_id):
+    """Drop view id's stored copy after its file was found outdated or
+    damaged, so that no layout is linked to it again"""
+    entry = get_entry(view_id)
+    if entry is None or not entry.get("store"):
+        return
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(entry["store"])
+    update_entry(view_id, store=None, sha=None, layouts=[])
+
+
+def add_layout(view_id, entry, category, **fields):
+    layouts = list(entry.get("layouts", []))
+    if layout(category) not in layouts:
+        layouts.append(layout(category))
+    update_entry(view_id, layouts=layouts, **fields)
+
+
+def scan_files(path):
+    """Return (path, stat) of the files under path that can be deduplicated"""
+    files = []
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    # metadata is written in place, linked copies would change together
+                    if entry.name not in (STORE, "metadata"):
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    if not entry.name.endswith((*PARTIAL_SUFFIXES, ".json", ".link")):
+                        files.append((entry.path, entry.stat(follow_symlinks=False)))
+    return files
+
+
+def dedupe(path):
+    """Replace identical files under path by hardlinks to one stored copy.
+
+    Only files of the same size are hashed, each inode once, and only files
+    of the same view id (or both without one) are linked together.
+    """
+    started = time.monotonic()
+    directories = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False) and entry.name != STORE:
+                directories.append(entry.path)
+    with ThreadPoolExecutor(max(config.num_threads, 1)) as executor:
+        for found in executor.map(scan_files, directories):
+            files.extend(found)
+
+        inodes = {}  # (device, inode) -> (path, stat), a file linked twice is one
+        for name, stat in files:
+            inodes.setdefault((stat.st_dev, stat.st_ino), (name, stat))
+        sizes = {}
+        for name, stat in inodes.values():
+            sizes.setdefault(stat.st_size, []).append((name, stat))
+        candidates = [
+            candidate
+            for same_size in sizes.values()
+            if len(same_size) > 1
+            for candidate in same_size
+        ]
+        hashes = executor.map(digest, [name for name, _ in candidates])
+        groups = {}
+        for (name, stat), sha in zip(candidates, hashes):
+            match = VIEW_ID_PATTERN.search(os.path.basename(name))
+            view_id = int(match[1]) if match else None
+            groups.setdefault((view_id, sha), []).append((name, stat))
+
+    linked = saved = 0
+    for (view_id, sha), same in groups.items():
+        if len(same) < 2:
+            continue
+        source = same[0][0]
+        stored = store_path(view_id, sha, os.path.splitext(source)[1])
+        if not os.path.isfile(stored):
+            link(source, stored, copy=False)
+        if os.path.isfile(stored):
+            source = stored
+            if view_id is not None and get_entry(view_id) is not None:
+                update_entry(view_id, sha=sha, store=stored)
+        for name, stat in same:
+            if os.path.samefile(name, source):
+                continue
+            if not link(source, name, copy=False):
+                break  # no hardlinks on this file system
+            linked += 1
+            if stat.st_nlink == 1:
+                saved += stat.st_size
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(
+        f"deduplicated {linked} of {len(files)} files, {saved / 1024 / 1024:.1f} MB \
+saved in {elapsed:.1f}s"
+    )
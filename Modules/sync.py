@@ -0,0 +1,123 @@
+"""High-water marks for --sync.
+
+sync.json in the output folder remembers, per crawled listing (gallery/koul,
+favorites/koul, msg/submissions, ...), the newest submission seen by the last
+complete crawl, so the next one stops as soon as it reaches it. Galleries and
+submissions are listed newest view id first; favorites are listed in the order
+they were faved, so for them the ids of the first page and its /next cursor
+(a monotonic fave id) are kept instead.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import Modules.config as config
+from Modules.cluster import node_file
+from Modules.functions import crawl_key
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def state_path():
+    return node_file("sync.json")
+
+
+def load_state():
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = {}
+            with contextlib.suppress(FileNotFoundError, ValueError):
+                with open(state_path(), encoding="utf-8") as f:
+                    _state = json.load(f)
+    return _state
+
+
+def save_mark(key, mark):
+    """Store the mark of one listing and rewrite sync.json atomically"""
+    state = load_state()
+    with _state_lock:
+        state[key] = mark
+        os.makedirs(config.output_folder, exist_ok=True)
+        with open(f"{state_path()}.tmp", encoding="utf-8", mode="w") as f:
+            json.dump(state, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{state_path()}.tmp", state_path())
+
+
+def cursor_number(page_num):
+    """Return the fave id of a favorites page token like "1234567/next" """
+    with contextlib.suppress(ValueError):
+        return int(str(page_num).split("/")[0])
+    return None
+
+
+def reached_last_sync(sync):
+    print(f'{config.SUCCESS_COLOR}Reached the last sync of "{sync.key}"{config.END}')
+    return True
+
+
+class HighWaterMark:
+    """Tracks one crawl of download_url against the mark of the previous one"""
+
+    def __init__(self, download_url):
+        self.key = crawl_key(download_url)
+        self.favorites = self.key.startswith("favorites/")
+        self.mark = load_state().get(self.key) if config.sync else None
+        self.latest_id = None
+        self.latest_ids = []
+        self.cursor = None
+
+    def reached(self, item):
+        """Remember a listed submission, return True if the previous sync
+        already saw it and the crawl can stop here"""
+        if self.favorites:
+            if self.cursor is None:
+                self.latest_ids.append(item.view_id)
+            if self.mark is not None and item.view_id in self.mark.get(
+                "latest_ids", []
+            ):
+                return True
+        else:
+            if self.latest_id is None or item.view_id > self.latest_id:
+                self.latest_id = item.view_id
+            if self.mark is not None and item.view_id <= self.mark.get("latest_id", 0):
+                return True
+        return False
+
+    def reached_page(self, page_num):
+        """Return True if a favorites page only holds faves older than the
+        first page of the previous sync, so it doesn't need to be fetched"""
+        if not self.favorites or not str(page_num).endswith("/next"):
+            return False
+        number = cursor_number(page_num)
+        if self.cursor is None:
+            self.cursor = number
+        return (
+            self.mark is not None
+            and self.mark.get("cursor") is not None
+            and number is not None
+            and number <= self.mark["cursor"]
+        )
+
+    def finish(self, page_num):
+        """Save the new mark once the crawl got through everything new, a dry
+        run didn't download anything and leaves the marks alone"""
+        if not config.sync or config.dry_run:
+            return
+        mark = dict(self.mark or {})
+        if self.favorites:
+            if self.latest_ids:
+                mark["latest_ids"] = self.latest_ids
+            if self.cursor is not None:
+                mark["cursor"] = self.cursor
+        elif self.latest_id is not None:
+            mark["latest_id"] = max(self.latest_id, mark.get("latest_id", 0))
+        mark["last_page"] = str(page_num)
+        mark["last_sync"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        save_mark(self.key, mark)
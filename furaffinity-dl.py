@@ -1,100 +1,328 @@
 #!/usr/bin/python3
-import contextlib
 import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from time import sleep
 
 from bs4 import BeautifulSoup
 
 import Modules.config as config
+from Modules.cluster import lease
+from Modules.cluster import print_progress
+from Modules.cluster import release
+from Modules.cluster import renew
 from Modules.download import download
-from Modules.functions import check_filter
+from Modules.functions import crawl_failed
 from Modules.functions import DownloadComplete
+from Modules.functions import DownloadError
+from Modules.functions import fetch_page
+from Modules.functions import interrupted
 from Modules.functions import login
-from Modules.functions import next_button
 from Modules.functions import requests_retry_session
-from Modules.functions import system_message_handler
-from Modules.index import check_file
+from Modules.functions import session_stats
 from Modules.index import start_indexing
+from Modules.journal import add_job
+from Modules.journal import clear_journal
+from Modules.journal import DONE
+from Modules.journal import FAILED
+from Modules.journal import failure_state
+from Modules.journal import IN_PROGRESS
+from Modules.journal import journal_path
+from Modules.journal import PENDING
+from Modules.journal import set_state
+from Modules.listing import Listing
+from Modules.manifest import manifest_jobs
+from Modules.manifest import manifest_key
+from Modules.manifest import progress_key
+from Modules.metrics import count
+from Modules.metrics import gauge
+from Modules.metrics import print_summary
+from Modules.metrics import start as start_metrics
+from Modules.prefetch import PagePrefetcher
+from Modules.progress import close as close_progress
+from Modules.retry import retry_delay
+from Modules.retry import RetryScheduler
+from Modules.store import dedupe
 
 # Terminate the process
 import threading
 import queue
-q = queue.Queue()
+# bounded look-ahead: the crawler blocks here instead of waiting for every
+# page's downloads to finish, so workers never idle at page boundaries
+q = queue.Queue(maxsize=max(config.queue_size, 1))
+# failed downloads wait here for their backoff, then go back into q
+retries = RetryScheduler(q.put)
 
 workers = []
 def worker():
     while True:
         item = q.get()
-        if item == 'shutdown':
-            break
-        download(item)
-        q.task_done()
-
-
-def main():
-    urls = []
-    """loop over and download all images on the page(s)"""
-    page_num = config.start
-    with contextlib.suppress(DownloadComplete):
-        while True:
-            if config.stop == page_num:
+        try:
+            if item == 'shutdown':
+                break
+            path, category, crawl_complete, slots, attempt = item
+            delay = None
+            try:
+                if not interrupted.is_set():
+                    delay = download_job(path, category, attempt)
+            except DownloadComplete:
+                # --check found an already downloaded file
+                crawl_complete.set()
+            except KeyboardInterrupt:
+                pass  # stays in the journal for the next run
+            except Exception as e:
+                # e.g. the journal or --claims database stayed locked, the
+                # job is left in the journal for the next run
                 print(
-                    f'{config.WARN_COLOR}Reached page "{config.stop}", \
-stopping.{config.END}'
+                    f"{config.ERROR_COLOR}exception when download {config.BASE_URL}{path}, \
+error {e}{config.END}"
                 )
-                break
+            finally:
+                if delay is not None:
+                    # the retry keeps its crawl's queue slot while it waits
+                    retries.schedule(
+                        delay, (path, category, crawl_complete, slots, attempt + 1)
+                    )
+                else:
+                    slots.release()
+        finally:
+            q.task_done()
+
+
+def download_job(path, category, attempt=0):
+    """download a queued submission once, keeping its journal state and
+    --claims lease up to date, return the backoff delay if it should be
+    retried"""
+    leased = False
+    done = False
+    delay = None
+    try:
+        if not lease(path):
+            # another node downloads it, nothing left to do here
+            count("submissions_skipped", reason="claimed")
+            set_state(path, DONE)
+            return None
+        leased = True
+        set_state(path, IN_PROGRESS)
+        download(path, category=category)
+        done = True
+    except KeyboardInterrupt:
+        set_state(path, PENDING)
+        raise
+    except DownloadComplete:
+        done = True
+        raise
+    except DownloadError as e:
+        delay = retry_delay(e, path, attempt)
+        set_state(path, failure_state(e) if delay is None else PENDING)
+        return delay
+    except Exception as e:
+        print(
+            f"{config.ERROR_COLOR}exception when download {config.BASE_URL}{path}, \
+error {e}{config.END}"
+        )
+        set_state(path, FAILED)
+        return None
+    finally:
+        if done:
+            set_state(path, DONE)
+        if delay is not None:
+            # the lease is kept while waiting for a retry
+            renew(int(path.split("/")[-2]), delay)
+        elif leased:
+            release(path, done)
+    return None
+
+
+def download_now(path, category=None):
+    """download in this thread, waiting out the backoff between attempts"""
+    attempt = 0
+    while True:
+        delay = download_job(path, category, attempt)
+        # wakes up early on Ctrl-C
+        if delay is None or interrupted.wait(delay):
+            return
+        attempt += 1
+
+
+def start_workers():
+    for id in range(config.num_threads):
+        print(id, 'started thread')
+        tmp = threading.Thread(target=worker, daemon=False)
+        workers.append(tmp)
+        tmp.start()
 
-            page_url = f"{download_url}/{page_num}"
-            response = requests_retry_session().get(page_url)
-            s = BeautifulSoup(response.text, "html.parser")
 
-            # System messages
-            if s.find(class_="notice-message") is not None:
-                system_message_handler(s)
+def stop_workers():
+    """let the workers drain the queue, then shut them down"""
+    # retries go back into the queue, so wait until neither has work left
+    q.join()
+    while not interrupted.is_set() and retries.wait():
+        q.join()
+    retries.close()
+    for _ in workers:
+        q.put("shutdown")
+    for t in workers:
+        t.join()
+    workers.clear()
+    close_progress()
+    stats = session_stats()
+    print(f"{stats['requests']} requests over {stats['connections']} connections")
+    print_summary()
+    print_progress()
 
-            # End of gallery
-            if s.find(id="no-images") is not None:
-                print(f"{config.SUCCESS_COLOR}End of gallery{config.END}")
+
+def crawl(crawls):
+    """download every (username, category, download_url) crawl with the
+    selected engine, --concurrent-crawls of them at a time, return False if
+    one of them failed or the run was interrupted"""
+    start_metrics()
+    if config.engine == "async":
+        # aiohttp is only required for the async engine
+        from Modules.async_download import run_async
+
+        return run_async(crawls)
+
+    if not config.disable_threading and config.crawl_only is None:
+        start_workers()
+    gauge("queue_depth", q.qsize)
+    jobs = queue.Queue()
+    for job in crawls:
+        jobs.put(job)
+    failed = []
+    crawlers = [
+        threading.Thread(target=crawler, args=(jobs, failed))
+        for _ in range(max(min(config.concurrent_crawls, len(crawls)), 1))
+    ]
+    # a KeyboardInterrupt in join() would leave the threads running unwaited
+    signal.signal(signal.SIGINT, stop_crawl)
+    for t in crawlers:
+        t.start()
+    for t in crawlers:
+        t.join()
+    stop_workers()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    if not interrupted.is_set():
+        # a failed crawl continues where it stopped next time
+        clear_journal(
+            [
+                progress_key(download_url)
+                for _, _, download_url in crawls
+                if download_url not in failed
+            ]
+        )
+    return not failed and not interrupted.is_set()
+
+
+def download_manifest(manifest):
+    """download the submissions of a --crawl-only manifest with the selected
+    engine, return False if the run was interrupted"""
+    start_metrics()
+    if config.engine == "async":
+        from Modules.async_download import run_async
+
+        return run_async([], manifest)
+
+    if not config.disable_threading:
+        start_workers()
+    gauge("queue_depth", q.qsize)
+    key = manifest_key(manifest)
+    crawl_complete = threading.Event()
+    slots = threading.BoundedSemaphore(max(config.queue_size, 1))
+    signal.signal(signal.SIGINT, stop_crawl)
+    try:
+        for path, category in manifest_jobs(manifest):
+            if interrupted.is_set() or crawl_complete.is_set():
                 break
+            queue_download(path, category, key, crawl_complete, slots)
+    except (DownloadComplete, KeyboardInterrupt):
+        pass
+    stop_workers()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    if interrupted.is_set():
+        return False
+    clear_journal([key])
+    return True
 
-            # Download all images on the page
-            for img in s.findAll("figure"):
-                title = img.find("figcaption").contents[0].text
-                img_url = img.find("a").attrs.get("href")
-
-                if config.submission_filter is True and check_filter(title) is True:
-                    print(
-                        f'{config.WARN_COLOR}"{title}" was filtered and will not be \
-downloaded - {config.BASE_URL}{img_url}{config.END}'
-                    )
-                    continue
-
-                if config.dont_redownload is True and check_file(img_url) is True:
-                    if config.check is True:
-                        print(
-                            f'{config.SUCCESS_COLOR}Downloaded all recent files of \
-"{username}"{config.END}'
-                        )
-                        raise DownloadComplete
-                    print(
-                        f'{config.WARN_COLOR}Skipping "{title}" since \
-it\'s already downloaded{config.END}'
-                    )
-                    continue
 
-                if config.disable_threading:
-                    download(img_url)
-                else:
-                    q.put(img_url)
+def stop_crawl(signum, frame):
+    """first Ctrl-C: let the threads wind down, a second one exits at once"""
+    interrupted.set()
+    retries.close()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    print(
+        f"{config.WARN_COLOR}Stopping, unfinished downloads are kept in \
+{journal_path()} for the next run{config.END}"
+    )
+
+
+def crawler(jobs, failed):
+    """run crawls from jobs until none are left, adding the download_url of
+    those that failed to failed"""
+    while True:
+        try:
+            username, category, download_url = jobs.get_nowait()
+        except queue.Empty:
+            return
+        if username is not None:
+            print(f'{config.SUCCESS_COLOR}Now downloading "{username}"{config.END}')
+            print(f"Downloading page {config.start} - {download_url}/{config.start}")
+        try:
+            main(username, category, download_url)
+        except KeyboardInterrupt:
+            return  # --disable-threading: interrupted while downloading
+        except Exception as e:
+            crawl_failed(download_url, e)
+            failed.append(download_url)
+            continue
+        if username is not None and not interrupted.is_set():
+            print(
+                f'{config.SUCCESS_COLOR}Finished \
+downloading "{username}"{config.END}'
+            )
+
+
+def main(username, category, download_url):
+    """loop over and download all images on the page(s)"""
+    listing = Listing(username, category, download_url)
+    # set by a worker when --check finds an already downloaded file
+    crawl_complete = threading.Event()
+    # this crawl's share of the download queue, so that concurrent crawls
+    # are served in turn and a huge gallery can't crowd out the rest
+    slots = threading.BoundedSemaphore(
+        max(config.queue_size // max(config.concurrent_crawls, 1), 1)
+    )
+    fetcher = ThreadPoolExecutor(max_workers=max(config.prefetch_pages, 1))
+    pages = PagePrefetcher(download_url, partial(fetcher.submit, fetch_page))
+
+    # work left behind by an interrupted run
+    for path in listing.resume():
+        queue_download(path, category, listing.key, crawl_complete, slots)
+
+    try:
+        while (page_num := listing.next_page(crawl_complete)) is not None:
+            page = pages.fetch(page_num, listing.look_ahead).result()
+            # Download all images on the page
+            for item in listing.submissions(page):
+                queue_download(item.path, category, listing.key, crawl_complete, slots)
                 sleep(config.interval)
-            q.join()
-            page_num = next_button(page_url)
-    if not config.disable_threading:
-        stop_threads = True
-        for _ in range(config.num_threads):
-            q.put("shutdown")
-        for t in workers:
-            t.join()
+    except DownloadComplete:
+        listing.stop(complete=True)
+    finally:
+        pages.close()
+        fetcher.shutdown(wait=False, cancel_futures=True)
+    listing.finish()
+
+
+def queue_download(path, category, key, crawl_complete, slots):
+    """journal a listed submission and hand it to the download workers"""
+    add_job(path, category, key)
+    if config.disable_threading:
+        download_now(path, category)
+    else:
+        slots.acquire()
+        q.put((path, category, crawl_complete, slots, 0))
 
 
 if __name__ == "__main__":
@@ -109,6 +337,11 @@ if __name__ == "__main__":
         print(f"{config.SUCCESS_COLOR}indexing finished{config.END}")
         exit()
 
+    if config.dedupe is True:
+        dedupe(config.output_folder)
+        print(f"{config.SUCCESS_COLOR}deduplication finished{config.END}")
+        exit()
+
     one_time_response = requests_retry_session().get(config.BASE_URL)
     one_time_s = BeautifulSoup(one_time_response.text, "html.parser")
     if one_time_s.find(class_="loggedin_user_avatar") is not None:
@@ -126,20 +359,21 @@ is inaccessible{config.END}"
         )
 
     if config.download is not None:
-        download(f"/view/{config.download}/")
+        download_now(f"/view/{config.download}/")
         exit()
 
-    if not config.disable_threading:
-        stop_threads = False
-        for id in range(config.num_threads):
-            print(id, 'started thread')
-            tmp = threading.Thread(target=worker, daemon=False)
-            workers.append(tmp)
-            tmp.start()
+    if config.from_manifest is not None:
+        if not download_manifest(config.from_manifest):
+            exit(1)
+        print(
+            f'{config.SUCCESS_COLOR}Finished downloading "{config.from_manifest}"\
+{config.END}'
+        )
+        exit()
 
     if config.submissions is True:
-        download_url = f"{config.BASE_URL}/msg/submissions"
-        main()
+        if not crawl([(None, config.category, f"{config.BASE_URL}/msg/submissions")]):
+            exit(1)
         print(
             f"{config.SUCCESS_COLOR}Finished \
 downloading submissions{config.END}"
@@ -151,14 +385,18 @@ downloading submissions{config.END}"
         download_url = (
             f"{config.BASE_URL}/gallery/{config.username}/folder/{config.folder}"
         )
-        main()
+        if not crawl([(config.username, config.category, download_url)]):
+            exit(1)
         print(
             f'{config.SUCCESS_COLOR}Finished \
 downloading "{config.folder[1]}"{config.END}'
         )
         exit()
 
-    if config.category not in ["gallery", "scraps", "favorites"]:
+    if any(
+        category not in ["gallery", "scraps", "favorites"]
+        for category in config.categories
+    ):
         print(
             f"{config.ERROR_COLOR}Please enter a valid category [gallery/scraps/favorites] {config.END}"
         )
@@ -169,18 +407,15 @@ downloading "{config.folder[1]}"{config.END}'
         config.parser.print_help()
         os._exit(1)
 
+    crawls = []
     for username in config.username:
         username = username.split("#")[0].translate(
             str.maketrans(config.username_replace_chars)
         )
         if username != "":
-
-            print(f'{config.SUCCESS_COLOR}Now downloading "{username}"{config.END}')
-            download_url = f"{config.BASE_URL}/{config.category}/{username}"
-            print(f"Downloading page {config.start} - {download_url}/{config.start}")
-            main()
-            print(
-                f'{config.SUCCESS_COLOR}Finished \
-downloading "{username}"{config.END}'
-            )
-
+            for category in config.categories:
+                crawls.append(
+                    (username, category, f"{config.BASE_URL}/{category}/{username}")
+                )
+    if not crawl(crawls):
+        exit(1)